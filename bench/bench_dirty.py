@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+
+"""bench_dirty -- Compare GitPython's is_dirty with new-homework's dirty check
+
+Creates a clean repository with many tracked files, then touches every file so
+that the stat information cached in the index is stale, as happens after the
+repository is copied or when a network filesystem reports new times. Times
+repeated dirty checks with Repo.is_dirty() and with new-homework's is_dirty(),
+each on its own copy of that state, and prints the results as JSON.
+
+    python3 bench/bench_dirty.py --files 100000 --dir /path/on/nfs
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from synth import load_new_homework
+
+
+def make_repo(path, nfiles, per_dir=1000):
+    """Create a git repository at path with nfiles small committed files."""
+    subprocess.run(['git', 'init', '-q', path], check=True)
+    for i in range(nfiles):
+        d = os.path.join(path, "d{:04d}".format(i // per_dir))
+        if i % per_dir == 0:
+            os.makedirs(d)
+        with open(os.path.join(d, "f{:06d}.txt".format(i)), "w") as f:
+            f.write("{}\n".format(i))
+    git = ['git', '-C', path, '-c', 'user.name=bench', '-c', 'user.email=bench@localhost',
+           '-c', 'gc.auto=0']
+    subprocess.run(git + ['add', '.'], check=True)
+    subprocess.run(git + ['commit', '-q', '-m', 'files'], check=True)
+
+
+def touch_all(path):
+    """Update the mtime of every file in the working tree of path."""
+    for dirpath, dirnames, filenames in os.walk(path):
+        if '.git' in dirnames:
+            dirnames.remove('.git')
+        for filename in filenames:
+            os.utime(os.path.join(dirpath, filename))
+
+
+def time_calls(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        dirty = func()
+        times.append(time.perf_counter() - start)
+        assert not dirty
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--dir", default=None,
+                        help="Scratch directory; use one on the filesystem you "
+                        "want to measure. Defaults to a temporary directory.")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="bench-dirty-", dir=args.dir)
+    try:
+        path = os.path.join(scratch, "repo")
+        make_repo(path, args.files)
+        copy = os.path.join(scratch, "copy")
+        shutil.copytree(path, copy, symlinks=True)
+        touch_all(path)
+        touch_all(copy)
+
+        nh = load_new_homework()
+        results = {'files': args.files,
+                   'gitpython': time_calls(nh.import_git().Repo(path).is_dirty, args.repeat),
+                   'new_homework': time_calls(lambda: nh.is_dirty(nh.import_git().Repo(copy)),
+                                              args.repeat)}
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+
+"""bench_install -- Compare the copy and link install modes of install_problem
+
+Generates a synthetic problem bank with many small files and a few huge ones,
+then installs its assignment repeatedly into fresh directories with each
+install mode, printing the timings as JSON. For the link mode, the first
+install populates the object store; later installs reuse it.
+
+    python3 bench/bench_install.py --small-files 5000 --huge-size 256
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+from synth import load_new_homework, make_bank
+
+
+def time_installs(nh, bank, workdir, mode, repeat):
+    times = []
+    for i in range(repeat):
+        hw_dir = os.path.join(workdir, "{}-{}".format(mode, i), "bench-hw")
+        os.makedirs(hw_dir)
+        start = time.perf_counter()
+        nh.install_problem("bench-hw", hw_dir, bank, mode)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--small-files", type=int, default=2000)
+    parser.add_argument("--small-size", type=int, default=4096,
+                        help="Size of each small file in bytes.")
+    parser.add_argument("--huge-files", type=int, default=2)
+    parser.add_argument("--huge-size", type=int, default=64,
+                        help="Size of each huge file in MiB.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dir", default=None,
+                        help="Scratch directory; use one on the filesystem you "
+                        "want to measure. Defaults to a temporary directory.")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="bench-install-", dir=args.dir)
+    os.environ['XDG_CACHE_HOME'] = os.path.join(scratch, "cache")
+    try:
+        bank = make_bank(os.path.join(scratch, "problem-bank"),
+                         small_files=args.small_files, small_size=args.small_size,
+                         huge_files=args.huge_files, huge_size=args.huge_size << 20)
+        nh = load_new_homework()
+        results = {'small_files': args.small_files,
+                   'small_size': args.small_size,
+                   'huge_files': args.huge_files,
+                   'huge_size': args.huge_size << 20}
+        for mode in nh.INSTALL_MODES:
+            results[mode] = time_installs(nh, bank, os.path.join(scratch, "hw"),
+                                          mode, args.repeat)
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+
+"""bench_startup -- Time the startup of new-homework.py on its fast paths
+
+Runs the script with --version, with --help, and on a request for an
+assignment that is not in the problem bank (which should fail before GitPython
+is imported), each several times, alongside a bare interpreter for reference.
+Reports the median wall times and, from python -X importtime, the costliest
+imports on each path, as JSON.
+
+Exits with status 1 if a fast path takes longer than --budget-ms or imports
+GitPython, so it can guard against startup regressions:
+
+    python3 bench/bench_startup.py --budget-ms 100
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from synth import SCRIPT, make_bank, make_homework_repo
+
+FAST_PATHS = ['version', 'unknown-assignment']
+
+
+def wall_ms(cmd, cwd, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def import_times(cmd, cwd):
+    """Return {module: cumulative microseconds} for top-level imports of cmd."""
+    proc = subprocess.run([cmd[0], '-X', 'importtime'] + cmd[1:], cwd=cwd,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):  # top-level imports only
+            imports[name.strip()] = int(cumulative)
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=100,
+                        help="Fail if a fast path's median wall time exceeds this.")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="bench-startup-")
+    os.environ['XDG_CACHE_HOME'] = os.path.join(scratch, "cache")
+    try:
+        make_bank(os.path.join(scratch, "problem-bank"), small_files=1, huge_files=0)
+        repo = make_homework_repo(os.path.join(scratch, "assignments-bench"))
+        script = [sys.executable, SCRIPT]
+        # Build the problem bank index once, as a previous run would have
+        subprocess.run(script + ['r', 'no-such-assignment'], cwd=repo,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        paths = {'interpreter': [sys.executable, '-c', 'pass'],
+                 'version': script + ['--version'],
+                 'help': script + ['--help'],
+                 'unknown-assignment': script + ['r', 'no-such-assignment']}
+        results = {}
+        for name, cmd in paths.items():
+            imports = import_times(cmd, repo)
+            results[name] = {
+                'median_ms': wall_ms(cmd, repo, args.repeat),
+                'imports_gitpython': 'git' in imports,
+                'top_imports': sorted(imports.items(), key=lambda i: -i[1])[:5],
+            }
+
+        failures = [name for name in FAST_PATHS
+                    if results[name]['median_ms'] > args.budget_ms
+                    or results[name]['imports_gitpython']]
+        results['budget_ms'] = args.budget_ms
+        results['failures'] = failures
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+
+"""bench_suite -- Benchmark provisioning end to end and phase by phase
+
+Generates a synthetic problem bank and an assignments repository with history
+and assignment branches (see synth.py), all reproducibly from --seed, then
+times:
+
++ end-to-end runs of new-homework.py, checking out and with --plumbing, for a
+  standalone assignment and for the next part of a vignette;
++ each profiled phase of in-process provisioning (see --profile);
++ problem_index, auto_branch_name, is_dirty, and install_problem on their own,
+  cold and warm.
+
+The repository is reset between runs. Results are written as JSON with the
+commit they were measured at, so that runs can be compared across commits:
+
+    python3 bench/bench_suite.py --output before.json
+    git checkout my-branch
+    python3 bench/bench_suite.py --output after.json
+    python3 bench/bench_suite.py --compare before.json after.json
+
+Comparing exits with status 1 if any benchmark's median slowed down by more
+than --threshold (and --min-delta seconds). Benchmarks of functions or options
+that new-homework.py lacks at the commit measured, such as --plumbing or
+problem_index on older commits, are skipped with a note, and so are left out
+of comparisons; all of them are skipped if it cannot be imported at all.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+from contextlib import redirect_stderr
+
+from synth import (SCRIPT, load_new_homework, make_suite_bank, make_history_repo,
+                   suite_names)
+
+
+def summarize(times):
+    times = sorted(times)
+    return {'n': len(times), 'min': times[0], 'median': statistics.median(times),
+            'p90': times[max(0, -(-len(times) * 9 // 10) - 1)], 'max': times[-1],
+            'times': times}
+
+
+def reset_repo(repo, branch, hdir_name):
+    """Undo the provisioning of hdir_name on branch in repo."""
+    git = ['git', '-C', repo]
+    subprocess.run(git + ['checkout', '-q', '-f', 'master'], check=True)
+    subprocess.run(git + ['branch', '-q', '-D', branch], stderr=subprocess.DEVNULL)
+    subprocess.run(git + ['clean', '-q', '-f', '-d', '-x'], check=True)
+    shutil.rmtree(os.path.join(repo, ".git", "new-homework"), ignore_errors=True)
+
+
+def targets(args):
+    """Return [(kind, language, assignment, branch)] to provision in the benchmarks.
+
+    The standalone assignment has no branch yet; the vignette is one whose
+    parts before the last are already branched (see make_history_repo).
+    """
+    standalone, vignette = suite_names(args.assignments, args.vignettes)
+    found = [('standalone', 'python', standalone[-1], standalone[-1])]
+    if args.vignettes > 2 and args.branches > 2:
+        found.append(('vignette', 'r', vignette[2], "{}-{}".format(vignette[2], args.parts)))
+    return found
+
+
+def available(nh, what, *names):
+    """Return whether new-homework.py, as module nh, has all of names.
+
+    If not, note that the benchmarks of what are skipped.
+    """
+    missing = [name for name in names if not hasattr(nh, name)]
+    if missing:
+        print("Skipping {}: new-homework.py has no {} at this commit."
+              .format(what, ", ".join(missing)), file=sys.stderr)
+    return not missing
+
+
+def script_options():
+    """Return the text of new-homework.py --help, to see which options it has."""
+    proc = subprocess.run([sys.executable, SCRIPT, '--help'], stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL, text=True)
+    return proc.stdout
+
+
+def bench_end_to_end(args, repo, results):
+    modes = [('checkout', [])]
+    if '--plumbing' in script_options():
+        modes.append(('plumbing', ['--plumbing']))
+    else:
+        print("Skipping e2e:plumbing: new-homework.py has no --plumbing at this commit.",
+              file=sys.stderr)
+    for kind, language, aname, branch in targets(args):
+        for mode, flags in modes:
+            times = []
+            for _ in range(args.repeat):
+                reset_repo(repo, branch, aname)
+                start = time.perf_counter()
+                subprocess.run([sys.executable, SCRIPT, language, aname] + flags,
+                               cwd=repo, check=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                times.append(time.perf_counter() - start)
+            results["e2e:{}:{}".format(mode, kind)] = summarize(times)
+            reset_repo(repo, branch, aname)
+
+
+def bench_phases(nh, args, repo, bank, results):
+    if not available(nh, "phase benchmarks", 'import_git', 'start_profiling',
+                     'stop_profiling', 'provision', 'provision_options'):
+        return
+    git = nh.import_git()
+    for kind, language, aname, branch in targets(args):
+        walls = {}
+        for _ in range(args.repeat):
+            reset_repo(repo, branch, aname)
+            r = git.Repo(repo)
+            nh.start_profiling()
+            with open(os.devnull, "w") as devnull, redirect_stderr(devnull):
+                nh.provision(r, language, aname, nh.provision_options(), bank)
+            run = {}
+            for record in nh.stop_profiling():
+                run[record['phase']] = run.get(record['phase'], 0) + record['wall']
+            for phase, wall in run.items():
+                walls.setdefault(phase, []).append(wall)
+            r.close()
+        for phase, times in walls.items():
+            results["phase:{}:{}".format(kind, phase)] = summarize(times)
+        reset_repo(repo, branch, aname)
+
+
+def time_calls(func, repeat, before=None):
+    times = []
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+def bench_functions(nh, args, repo, bank, scratch, results):
+    import git
+
+    r = git.Repo(repo)
+    if available(nh, "problem_index", 'problem_index', '_problem_indexes', 'cache_dir'):
+        nh.problem_index(bank)
+        index_file = os.path.join(nh.cache_dir("banks"), [
+            f for f in os.listdir(nh.cache_dir("banks")) if f.endswith(".json")][0])
+
+        def forget_index():
+            nh._problem_indexes.clear()
+
+        def drop_index():
+            forget_index()
+            os.unlink(index_file)
+
+        results["problem_index:cold"] = time_calls(lambda: nh.problem_index(bank), args.repeat, drop_index)
+        results["problem_index:warm"] = time_calls(lambda: nh.problem_index(bank), args.repeat, forget_index)
+
+    _, vignette = suite_names(args.assignments, args.vignettes)
+    if available(nh, "auto_branch_name:cold", 'forget_refs'):
+        results["auto_branch_name:cold"] = time_calls(
+            lambda: nh.auto_branch_name(r, vignette[2]), args.repeat, lambda: nh.forget_refs(r))
+    results["auto_branch_name:warm"] = time_calls(
+        lambda: nh.auto_branch_name(r, vignette[2]), args.repeat)
+    if available(nh, "is_dirty", 'is_dirty'):
+        results["is_dirty"] = time_calls(lambda: nh.is_dirty(r), args.repeat)
+
+    aname = targets(args)[0][2]
+    # Before install modes, install_problem always copied
+    modes = getattr(nh, 'INSTALL_MODES', [None])
+    for mode in modes:
+        runs = iter(range(args.repeat))
+
+        def fresh_dir():
+            hw_dir = os.path.join(scratch, "install-{}-{}".format(mode, next(runs)), aname)
+            os.makedirs(hw_dir)
+            return hw_dir
+
+        def install():
+            if mode is None:
+                nh.install_problem(aname, dirs[-1], bank)
+            else:
+                nh.install_problem(aname, dirs[-1], bank, mode)
+
+        dirs = []
+        results["install_problem:" + (mode or 'copy')] = time_calls(
+            install, args.repeat, lambda: dirs.append(fresh_dir()))
+    r.close()
+
+
+def package_commit():
+    def git(*cmd):
+        proc = subprocess.run(['git', '-C', os.path.dirname(SCRIPT)] + list(cmd),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        return proc.stdout.strip()
+    return {'commit': git('rev-parse', 'HEAD'),
+            'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+
+def run(args):
+    scratch = tempfile.mkdtemp(prefix="bench-suite-", dir=args.dir)
+    os.environ['XDG_CACHE_HOME'] = os.path.join(scratch, "cache")
+    try:
+        start = time.perf_counter()
+        bank = make_suite_bank(os.path.join(scratch, "problem-bank"), args.assignments,
+                               args.vignettes, args.parts, args.data_files, args.data_size,
+                               args.size_sigma, args.seed)
+        repo = make_history_repo(os.path.join(scratch, "assignments-bench"), args.branches,
+                                 args.depth, args.parts, args.seed)
+        setup = time.perf_counter() - start
+
+        results = {}
+        bench_end_to_end(args, repo, results)
+        try:
+            nh = load_new_homework()
+        except Exception as e:
+            print("Skipping the phase and function benchmarks: cannot import "
+                  "new-homework.py at this commit ({}: {}).".format(type(e).__name__, e),
+                  file=sys.stderr)
+        else:
+            bench_phases(nh, args, repo, bank, results)
+            bench_functions(nh, args, repo, bank, scratch, results)
+        return {'meta': dict(package_commit(),
+                             python=platform.python_version(),
+                             platform=platform.platform(),
+                             time=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                             setup_seconds=setup,
+                             params={k: v for k, v in vars(args).items()
+                                     if k not in ('output', 'compare', 'keep', 'dir', 'threshold', 'min_delta')}),
+                'results': results}
+    finally:
+        if args.keep:
+            print("Kept benchmark data in {}".format(scratch), file=sys.stderr)
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+def compare(old_path, new_path, threshold, min_delta):
+    """Print the change in median of each benchmark; return the names that regressed.
+
+    A benchmark regressed if it slowed down by more than threshold, as a
+    fraction, and by more than min_delta seconds, so that noise in the
+    quickest benchmarks is not reported.
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if old['meta']['params'] != new['meta']['params']:
+        print("Warning: the runs used different parameters.", file=sys.stderr)
+
+    regressed = []
+    print("{:<44} {:>10} {:>10} {:>8}".format(
+        "benchmark", old['meta']['commit'][:10], new['meta']['commit'][:10], "change"))
+    for name in sorted(set(old['results']) & set(new['results'])):
+        a = old['results'][name]['median']
+        b = new['results'][name]['median']
+        change = b / a - 1 if a else 0
+        flag = ""
+        if change > threshold and b - a > min_delta:
+            regressed.append(name)
+            flag = "  slower"
+        print("{:<44} {:>9.1f}ms {:>8.1f}ms {:>+7.1%}{}".format(name, a * 1000, b * 1000, change, flag))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--assignments", type=int, default=200,
+                        help="Standalone assignments in the bank's points.csv.")
+    parser.add_argument("--vignettes", type=int, default=20)
+    parser.add_argument("--parts", type=int, default=4, help="Parts per vignette.")
+    parser.add_argument("--data-files", type=float, default=10,
+                        help="Mean number of Data files per assignment.")
+    parser.add_argument("--data-size", type=int, default=8192,
+                        help="Median size of a Data file in bytes.")
+    parser.add_argument("--size-sigma", type=float, default=1.0,
+                        help="Shape of the lognormal distribution of Data file sizes.")
+    parser.add_argument("--branches", type=int, default=100,
+                        help="Assignment branches in the repository.")
+    parser.add_argument("--depth", type=int, default=500,
+                        help="Commits in the repository's master branch.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--dir", default=None,
+                        help="Directory in which to generate the data, e.g. on NFS.")
+    parser.add_argument("--keep", action='store_true',
+                        help="Keep the generated bank and repository.")
+    parser.add_argument("--output", default=None,
+                        help="Write the results to this file rather than standard output.")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="Compare two result files instead of running benchmarks.")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="With --compare, the slowdown counted as a regression.")
+    parser.add_argument("--min-delta", type=float, default=0.001,
+                        help="With --compare, ignore slowdowns of fewer seconds than this.")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold, args.min_delta) else 0)
+
+    if args.assignments <= args.branches:
+        parser.error("--assignments must exceed --branches, leaving one to provision")
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
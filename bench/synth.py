@@ -0,0 +1,174 @@
+# -*- mode: python; coding: utf-8 -*-
+
+"""synth -- Synthetic problem banks and helpers for the benchmarks
+
+The benchmarks in this directory exercise new-homework.py against generated
+problem banks, so that their results do not depend on the contents of the real
+problem-bank repository.
+"""
+
+import os
+import os.path
+import sys
+import math
+import random
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(os.path.dirname(BENCH_DIR), "new-homework.py")
+
+
+def load_new_homework():
+    """Import new-homework.py as a module and return it."""
+    sys.path.insert(0, os.path.dirname(SCRIPT))
+    import new_homework
+    return new_homework
+
+
+def write_random_file(path, size, chunk=1 << 20):
+    """Write size bytes of random data to path."""
+    with open(path, "wb") as f:
+        while size > 0:
+            n = min(size, chunk)
+            f.write(os.urandom(n))
+            size -= n
+
+
+def make_bank(root, name="bench-hw", small_files=1000, small_size=4096,
+              huge_files=2, huge_size=64 << 20):
+    """Create a problem bank at root containing one assignment, name.
+
+    The assignment's Data directory holds small_files files of small_size bytes
+    spread over a few subdirectories, plus huge_files files of huge_size bytes.
+    Returns the path of the problem bank.
+    """
+    os.makedirs(os.path.join(root, "All"), exist_ok=True)
+    with open(os.path.join(root, "points.csv"), "w") as f:
+        f.write("name,points\n{},10\n".format(name))
+    with open(os.path.join(root, "All", name + ".pdf"), "wb") as f:
+        f.write(b"%PDF-1.4\n")
+
+    data = os.path.join(root, "Data", name)
+    for i in range(small_files):
+        sub = os.path.join(data, "part{:02d}".format(i % 16))
+        os.makedirs(sub, exist_ok=True)
+        write_random_file(os.path.join(sub, "f{:05d}.csv".format(i)), small_size)
+    os.makedirs(data, exist_ok=True)
+    for i in range(huge_files):
+        write_random_file(os.path.join(data, "huge{}.bin".format(i)), huge_size)
+
+    skel = os.path.join(root, ".skel", "python")
+    os.makedirs(skel, exist_ok=True)
+    with open(os.path.join(skel, "ASSIGN.py"), "w") as f:
+        f.write("# ASSIGN\n")
+    return root
+
+
+def make_homework_repo(path):
+    """Create an assignments repository at path with a clean-start tag."""
+    git = ['git', '-C', path, '-c', 'user.name=bench', '-c', 'user.email=bench@localhost']
+    subprocess.run(['git', 'init', '-q', '-b', 'master', path], check=True)
+    with open(os.path.join(path, "README.org"), "w") as f:
+        f.write("#+TITLE: Assignments Repository\n")
+    subprocess.run(git + ['add', '.'], check=True)
+    subprocess.run(git + ['commit', '-q', '-m', 'Initial commit'], check=True)
+    subprocess.run(git + ['tag', 'clean-start'], check=True)
+    return path
+
+
+def suite_names(assignments, vignettes):
+    """Return the standalone and vignette assignment names of a suite bank."""
+    return (["a{:04d}".format(i) for i in range(assignments)],
+            ["v{:03d}".format(i) for i in range(vignettes)])
+
+
+def make_suite_bank(root, assignments=200, vignettes=20, parts=4, data_files=10,
+                    data_size=8192, size_sigma=1.0, seed=0):
+    """Create a problem bank at root with many assignments, reproducibly.
+
+    The bank lists assignments standalone assignments and vignettes vignettes
+    of parts parts each in points.csv. Each has a PDF and a Data directory of
+    a Poisson-distributed number of files (mean data_files) whose sizes are
+    lognormally distributed around data_size bytes with shape size_sigma. All
+    contents are drawn from a generator seeded with seed. Returns the path of
+    the problem bank.
+    """
+    rng = random.Random(seed)
+    standalone, vignette = suite_names(assignments, vignettes)
+    os.makedirs(os.path.join(root, "All"), exist_ok=True)
+    with open(os.path.join(root, "points.csv"), "w") as f:
+        f.write("name,points\n")
+        for name in standalone:
+            f.write("{},10\n".format(name))
+        for name in vignette:
+            f.write("{},5\n".format(name) * parts)
+
+    for name in standalone + vignette:
+        with open(os.path.join(root, "All", name + ".pdf"), "wb") as f:
+            f.write(b"%PDF-1.4\n" + rng.randbytes(rng.randint(1000, 100000)))
+        data = os.path.join(root, "Data", name)
+        os.makedirs(data, exist_ok=True)
+        # Poisson by counting exponential arrivals in a unit interval
+        nfiles, t = 0, rng.expovariate(data_files) if data_files else 1
+        while t < 1:
+            nfiles, t = nfiles + 1, t + rng.expovariate(data_files)
+        for i in range(nfiles):
+            size = int(rng.lognormvariate(math.log(data_size), size_sigma))
+            with open(os.path.join(data, "f{:03d}.csv".format(i)), "wb") as f:
+                f.write(rng.randbytes(size))
+
+    for lang, text in [("python", "# ASSIGN\n"), ("r", "ASSIGN <- function() {}\n")]:
+        skel = os.path.join(root, ".skel", lang)
+        os.makedirs(skel, exist_ok=True)
+        with open(os.path.join(skel, "ASSIGN." + ("py" if lang == "python" else "R")), "w") as f:
+            f.write(text)
+    return root
+
+
+def make_history_repo(path, branches=100, depth=500, parts=4, seed=0):
+    """Create an assignments repository at path with history and branches.
+
+    master has depth commits, the first tagged clean-start, each changing a
+    file. branches of the bank's assignments (standalone names, then vignette
+    parts up to parts - 1) each add one commit off master. The history is
+    written with git fast-import, so large repositories are quick to make.
+    """
+    rng = random.Random(seed)
+    subprocess.run(['git', 'init', '-q', '-b', 'master', path], check=True)
+    standalone, vignette = suite_names(branches, branches)
+    names = []
+    for i in range(branches):
+        if i % 3 == 2:
+            root = vignette[i]
+            names.extend("{}-{}".format(root, k) for k in range(1, parts))
+        else:
+            names.append(standalone[i])
+
+    who = "bench <bench@localhost> {} +0000"
+    out = []
+
+    def data(text):
+        raw = text.encode()
+        out.append(b"data %d\n%s\n" % (len(raw), raw))
+
+    when = 1500000000
+    for n in range(1, depth + 1):
+        when += 3600
+        out.append("commit refs/heads/master\nmark :{}\ncommitter {}\n".format(n, who.format(when)).encode())
+        data("Commit {}".format(n))
+        if n > 1:
+            out.append("from :{}\n".format(n - 1).encode())
+        out.append(b"M 644 inline history.txt\n")
+        data("{} {}\n".format(n, rng.random()))
+    for i, name in enumerate(names):
+        out.append("commit refs/heads/{}\ncommitter {}\n".format(name, who.format(when + i)).encode())
+        data(name)
+        out.append("from :{}\nM 644 inline {}/README\n".format(depth, name.rsplit('-', 1)[0]).encode())
+        data(name + "\n")
+    out.append(b"reset refs/tags/clean-start\nfrom :1\n")
+
+    subprocess.run(['git', '-C', path, 'fast-import', '--quiet'], input=b"".join(out), check=True)
+    subprocess.run(['git', '-C', path, 'checkout', '-q', '-f', 'master'], check=True)
+    for key, value in [('user.name', 'bench'), ('user.email', 'bench@localhost')]:
+        subprocess.run(['git', '-C', path, 'config', key, value], check=True)
+    return path
@@ -0,0 +1,417 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+
+"""grade-homework -- Lint and test every assignment branch of homework repositories
+
+For each assignment branch of each repository given, this does what check.R
+does for one assignment directory -- lintr's lint_dir and testthat's test_dir
+-- and prints a consolidated report:
+
+    python3 grade-homework.py assignments-alice assignments-bob ...
+
+An assignment branch is one with a top-level directory named after it, or,
+for a vignette part like cow-proximity-2, after its root (cow-proximity).
+Each assignment directory is checked out into a temporary directory of its
+own, straight from the repository's objects, so the repositories' working
+trees and branches are left alone and may even be bare.
+
+The directories are checked in parallel by --workers processes. Results are
+cached by the git tree hash of the assignment directory (and the versions of
+R, lintr, and testthat, which are asked once per run), so a submission that
+has not changed since it was last graded (or that is identical to another,
+such as an untouched template) is not checked again; --force re-checks. Runs
+that R could not complete are not cached.
+
+With --report, the full results, including the output of lint_dir and
+test_dir, are also written as JSON. The exit status is 1 if any directory
+could not be checked at all (R failed or timed out), whatever the tests'
+outcome.
+
+"""
+
+import sys
+import os
+import os.path
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+import new_homework as nh
+from new_homework import HomeworkError, die, log
+
+# Bump to invalidate cached results when the way they are computed changes
+GRADE_CACHE_VERSION = 1
+
+# Run in the assignment directory by Rscript. Between the lint and test output,
+# marker lines carry the counts for the report.
+CHECK_R = r'''
+suppressPackageStartupMessages({
+    library(lintr)
+    library(testthat)
+})
+
+cat("\nLinting:\n")
+lints <- lint_dir(".")
+print(lints)
+cat("\n@@lints", length(lints), "\n")
+
+cat("\n\nTesting:\n")
+results <- tryCatch(
+    as.data.frame(test_dir(".", stop_on_failure = FALSE)),
+    error = function(e) {
+        message(conditionMessage(e))
+        NULL
+    })
+if (is.null(results) || nrow(results) == 0) {
+    cat("\n@@tests 0 0 0 0\n")
+} else {
+    cat("\n@@tests", sum(results$nb), sum(results$failed),
+        sum(results$skipped), sum(results$error), "\n")
+}
+'''
+
+# Prints the versions of what CHECK_R runs on, which results also depend on
+VERSIONS_R = r'''
+cat(R.version.string, "\n")
+for (package in c("lintr", "testthat")) {
+    cat(package, format(packageVersion(package)), "\n")
+}
+'''
+
+STATUSES = ['passed', 'failed', 'error', 'timeout']
+
+
+# Finding assignment branches
+
+MAIN_BRANCHES = ['master', 'main']
+
+
+def assignment_dir_candidates(branch):
+    """Return the directory names that could hold branch's assignment, best first."""
+    root, _, part = branch.rpartition('-')
+    if root and part.isdigit():
+        return [branch, root]
+    return [branch]
+
+
+def assignment_branches(repo_dir, patterns=None):
+    """Find the assignment branches of the repository at repo_dir.
+
+    Return a list of dicts with the repo, branch, assignment directory name,
+    and the hash of that directory's tree. Only branches matching one of the
+    glob patterns are considered, if any are given. The trees are looked up
+    in one git cat-file process, however many branches there are.
+    """
+    from fnmatch import fnmatchcase
+
+    branches = nh.run_git(repo_dir, 'for-each-ref', '--format=%(refname:short)',
+                          'refs/heads/').split()
+    branches = [b for b in branches if b not in MAIN_BRANCHES and
+                (not patterns or any(fnmatchcase(b, p) for p in patterns))]
+
+    queries = [(b, d) for b in branches for d in assignment_dir_candidates(b)]
+    lines = "".join("{}:{}\n".format(b, d) for b, d in queries)
+    found = nh.run_git(repo_dir, 'cat-file', '--batch-check', input=lines.encode())
+
+    entries = {}
+    for (branch, hdir_name), line in zip(queries, found.splitlines()):
+        fields = line.split()
+        if branch not in entries and len(fields) == 3 and fields[1] == 'tree':
+            entries[branch] = {'repo': repo_dir, 'branch': branch,
+                               'assignment': hdir_name, 'tree': fields[0]}
+    skipped = [b for b in branches if b not in entries]
+    if skipped:
+        log("{}: not assignment branches: {}".format(repo_dir, ", ".join(skipped)))
+    return [entries[b] for b in branches if b in entries]
+
+
+# Checking assignment directories
+
+def checker_versions(rscript):
+    """Return the lines naming the versions of R, lintr, and testthat that rscript runs."""
+    import subprocess
+
+    proc = subprocess.run([rscript, '--vanilla', '-e', VERSIONS_R],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        stderr = proc.stderr.decode(errors='replace').strip()
+        die("Cannot find the versions of R, lintr, and testthat with {}.".format(rscript),
+            *([stderr] if stderr else []))
+    return [line.strip() for line in proc.stdout.decode().splitlines() if line.strip()]
+
+
+def checker_fingerprint(rscript, versions):
+    """Return a hash of everything besides the tree that a result depends on.
+
+    That is the check itself and the versions of R and the packages it runs,
+    as returned by checker_versions, so that upgrading any of them
+    invalidates cached results.
+    """
+    h = hashlib.sha256()
+    h.update("{}\0{}\0{}\0{}".format(GRADE_CACHE_VERSION, os.path.basename(rscript),
+                                     CHECK_R, "\n".join(versions)).encode())
+    return h.hexdigest()[:16]
+
+
+def result_cache_path(checker, tree):
+    return os.path.join(nh.cache_dir("grades", checker), tree + ".json")
+
+
+def read_cached_result(checker, tree):
+    try:
+        with open(result_cache_path(checker, tree), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def materialize(repo_dir, tree, hdir_name, dest):
+    """Check out tree from the repository at repo_dir as the directory dest/hdir_name.
+
+    The files are written through a temporary index, so the repository's own
+    index, working tree, and worktree list are untouched.
+    """
+    env = {'GIT_INDEX_FILE': os.path.join(dest, ".index")}
+    nh.run_git(repo_dir, 'read-tree', tree, env=env)
+    nh.run_git(repo_dir, '--work-tree=' + dest, 'checkout-index', '--all',
+               '--prefix=' + os.path.join(dest, hdir_name) + os.sep, env=env)
+    os.unlink(env['GIT_INDEX_FILE'])
+    return os.path.join(dest, hdir_name)
+
+
+def parse_counts(output):
+    """Return the counts from the marker lines of CHECK_R's output, or None."""
+    counts = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if fields and fields[0] == '@@lints' and len(fields) == 2:
+            counts['lints'] = int(fields[1])
+        elif fields and fields[0] == '@@tests' and len(fields) == 5:
+            counts.update(zip(['tests', 'failures', 'skipped', 'errors'],
+                              map(int, fields[1:])))
+    return counts if len(counts) == 5 else None
+
+
+def check_tree(entry, checker, rscript, timeout):
+    """Lint and test the assignment directory of entry, caching the result.
+
+    Run in a worker process. Return a result dict with the status (one of
+    STATUSES), the counts parsed from the output, the output itself, and the
+    time taken.
+    """
+    import subprocess
+
+    start = time.monotonic()
+    result = {'tree': entry['tree'], 'checked': time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+    scratch = tempfile.mkdtemp(prefix="grade-homework-")
+    try:
+        hw_dir = materialize(entry['repo'], entry['tree'], entry['assignment'], scratch)
+        proc = subprocess.run([rscript, '--vanilla', '-e', CHECK_R], cwd=hw_dir,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              timeout=timeout)
+        output = proc.stdout.decode(errors='replace')
+        counts = parse_counts(output)
+        if proc.returncode != 0 or counts is None:
+            result.update(status='error', returncode=proc.returncode)
+        else:
+            failed = counts['failures'] or counts['errors']
+            result.update(counts, status='failed' if failed else 'passed')
+        result['output'] = output
+    except subprocess.TimeoutExpired as e:
+        result.update(status='timeout',
+                      output=(e.output or b"").decode(errors='replace'))
+    except HomeworkError as e:
+        result.update(status='error', output="\n".join(str(m) for m in e.args))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    result['seconds'] = round(time.monotonic() - start, 3)
+
+    # Errors in a submission's code show up in the counts; a run that failed
+    # or timed out is more likely the machine's fault, so is tried again later
+    if result['status'] in ('passed', 'failed'):
+        nh.write_json_atomically(result_cache_path(checker, entry['tree']), result)
+    return result
+
+
+def init_grade_worker(verbosity):
+    nh.verbose = verbosity
+
+
+def grade(entries, opts, versions):
+    """Fill in the result of checking each entry, checking each distinct tree once.
+
+    Results are taken from the cache unless opts.force, for the versions of
+    R and its packages given (see checker_versions); the remaining trees are
+    checked in a pool of opts.workers processes. Each entry gets the
+    result's fields and 'cached', whether the result was already known.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    checker = checker_fingerprint(opts.rscript, versions)
+    results = {}
+    todo = {}
+    for entry in entries:
+        tree = entry['tree']
+        if tree in results or tree in todo:
+            continue
+        cached = None if opts.force else read_cached_result(checker, tree)
+        if cached is not None:
+            results[tree] = dict(cached, cached=True)
+        else:
+            todo[tree] = entry
+    log("{} assignment directories, {} distinct, {} to check".format(
+        len(entries), len(results) + len(todo), len(todo)))
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=opts.workers,
+                                 initializer=init_grade_worker,
+                                 initargs=(nh.verbose,)) as pool:
+            futures = {pool.submit(check_tree, entry, checker, opts.rscript,
+                                   opts.timeout): tree
+                       for tree, entry in todo.items()}
+            for done, future in enumerate(as_completed(futures), 1):
+                results[futures[future]] = dict(future.result(), cached=False)
+                log("Checked {} of {} directories".format(done, len(todo)))
+
+    for entry in entries:
+        entry.update(results[entry['tree']])
+    return entries
+
+
+# Reporting
+
+def print_report(entries, file=sys.stdout):
+    """Print one line for each entry, grouped by repository, and a summary."""
+    repo = None
+    for e in sorted(entries, key=lambda e: (e['repo'], e['branch'])):
+        if e['repo'] != repo:
+            repo = e['repo']
+            print("{}:".format(repo), file=file)
+        if e['status'] in ('passed', 'failed'):
+            detail = "{} tests, {} failed, {} errors, {} skipped; {} lints".format(
+                e['tests'], e['failures'], e['errors'], e['skipped'], e['lints'])
+        else:
+            detail = "could not be checked; see --report for its output"
+        print("  {:<8} {:<30} {}{}".format(e['status'], e['branch'], detail,
+                                           " (cached)" if e['cached'] else ""),
+              file=file)
+
+    tally = {s: sum(1 for e in entries if e['status'] == s) for s in STATUSES}
+    print("{} branches: {}; {} results from the cache.".format(
+        len(entries), ", ".join("{} {}".format(n, s) for s, n in tally.items()),
+        sum(1 for e in entries if e['cached'])), file=file)
+
+
+def write_report(entries, path, versions):
+    with open(path, "w") as f:
+        json.dump({'version': nh.__version__,
+                   'checker': versions,
+                   'generated': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                   'results': entries}, f, indent=1)
+
+
+# Main Script
+
+def build_parser():
+    """Return the command-line argument parser."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Lint and test the assignment "
+                                     "branches of homework repositories.",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog=__doc__[__doc__.index('\n'):])
+
+    parser.add_argument("-B", "--branch",
+                        action='append',
+                        default=[],
+                        metavar="PATTERN",
+                        help="Only grade branches matching the glob PATTERN, like "
+                        "'cow-proximity*'. May be given more than once.")
+
+    parser.add_argument("--report",
+                        default="",
+                        metavar="FILE",
+                        help="Also write the results, with the output of each check, "
+                        "to FILE as JSON.")
+
+    parser.add_argument("--workers",
+                        type=int,
+                        default=os.cpu_count(),
+                        help="Number of worker processes checking directories at once. "
+                        "Defaults to the number of CPUs.")
+
+    parser.add_argument("--timeout",
+                        type=float,
+                        default=300,
+                        help="Seconds allowed for checking one directory before "
+                        "giving up on it. Unlike results, timeouts are not cached.")
+
+    parser.add_argument("--force",
+                        default=False,
+                        action='store_true',
+                        help="Check every directory again, ignoring cached results.")
+
+    parser.add_argument("--rscript",
+                        default="Rscript",
+                        help="The Rscript program to run the checks with.")
+
+    parser.add_argument("-v", "--verbose",
+                        default=False,
+                        action='store_true',
+                        help="Print detailed messages about progress.")
+
+    parser.add_argument("--version",
+                        action='version',
+                        version="%(prog)s " + nh.__version__)
+
+    parser.add_argument("repos",
+                        nargs="*",
+                        default=["."],
+                        metavar="REPO",
+                        help="Homework repositories to grade. Defaults to the "
+                        "current directory.")
+
+    return parser
+
+
+def run(args):
+    """Grade the repositories of args; report errors and return the exit status."""
+    nh.verbose = args.verbose
+    try:
+        rscript = shutil.which(args.rscript)
+        if rscript is None:
+            die("Cannot find {} to run the checks.".format(args.rscript),
+                "Install R with the lintr and testthat packages, or see --rscript.")
+        args.rscript = rscript
+
+        entries = []
+        for repo_dir in args.repos:
+            if nh.find_git_dirs(repo_dir) is None and \
+                    not os.path.isfile(os.path.join(repo_dir, 'HEAD')):
+                die("{} is not a git repository.".format(repo_dir),
+                    error=nh.RepositoryError)
+            entries.extend(assignment_branches(os.path.abspath(repo_dir), args.branch))
+        if not entries:
+            die("Found no assignment branches to grade.")
+
+        versions = checker_versions(args.rscript)
+        grade(entries, args, versions)
+    except HomeworkError as e:
+        nh.report_error(e)
+        return 1
+
+    print_report(entries)
+    if args.report:
+        write_report(entries, args.report, versions)
+    return 1 if any(e['status'] in ('error', 'timeout') for e in entries) else 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
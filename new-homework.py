@@ -24,7 +24,50 @@ unit tests; for 'none'; nothing will be installed.
 
 For vignettes, if you also supply -x (--suffix) you can specify a larger number,
 such as when skipping vignette exercises. To avoid reinstalling description and
-resource files in later parts, you can add --no-install.
+resource files in later parts, you can add --no-install. To create the branches
+for all the remaining parts in one go, add --all-parts.
+
+In repositories with many earlier assignments, --plumbing creates the branch and
+its initial commit directly from the problem bank without checking anything
+out; add --checkout to switch to the new branch afterwards. Alternatively, --worktree
+sets up the new branch in a separate worktree containing only the assignment.
+
+To provision many assignments at once, list them in a manifest (a CSV file
+with columns repo, language, and assignment, or the equivalent JSONL) and run
+
+    python3 new-homework.py --batch manifest.csv
+
+Repositories are provisioned in parallel, and completed entries are recorded
+in a journal so that an interrupted batch can simply be run again.
+
+On network storage, where reading many small files is slow, staff can pack the
+problem bank into a single indexed file with
+
+    python3 new-homework.py --pack-bank -p problem-bank
+
+Assignments are then installed from the pack while the bank's checked-out
+commit and its set of assignments are as they were when it was packed, and
+from the bank's directories once either changes, until it is packed again.
+Edits to a bank's files that are not committed go unnoticed, so pack again
+after making them (or after any change to a bank that is not a git checkout).
+
+Where many assignments are started at once, a daemon can keep the problem bank
+index and warm worker processes in memory:
+
+    python3 new-homework.py --serve /run/new-homework.sock -p problem-bank
+
+Then any command given --socket /run/new-homework.sock (or run with
+NEW_HOMEWORK_SOCKET set) is carried out by the daemon, one at a time for each
+repository, from the daemon's problem bank whatever -p the command gives. The
+daemon serves only its own user, so each user who wants one runs their own.
+
+The same pipeline can be driven from Python, reusing open repositories and a
+loaded problem bank across calls; failures raise subclasses of HomeworkError:
+
+    import git, new_homework as nh
+    bank = nh.ProblemBank("../problem-bank")
+    nh.provision(git.Repo("."), "python", "hw-name",
+                 nh.provision_options(plumbing=True), bank)
 
 Ordinarily, the script will exit with an error if the assignment branch already
 exists, but that can be overridden with --warn-if-exists. It also makes a
@@ -37,38 +80,75 @@ initial commit is made.
 import sys
 import os
 import os.path
-import re
-import argparse
-import shutil
-import csv
-
-from contextlib import contextmanager
-
-try:
-    from git import Repo
-    from git.exc import InvalidGitRepositoryError
-except ModuleNotFoundError:
-    print("Error: GitPython module is not installed!")
-    print("Make sure you install it first:")
-    print("pip install GitPython")
-    sys.exit(1)
+import json
+import hashlib
+import io
+import stat
+import struct
+import zlib
+import threading
+import time
+import functools
+
+from contextlib import asynccontextmanager, contextmanager
+from collections import Counter
+from types import SimpleNamespace
+
+# GitPython, argparse, asyncio, and the other costlier modules are imported
+# where they are first needed, so that --version and the checks that fail fast
+# do not pay for them.
 
 __version__ = '0.4.0'
 
-@contextmanager
-def cd(newdir):
-    prevdir = os.getcwd()
-    os.chdir(os.path.expanduser(newdir))
-    try:
-        yield
-    finally:
-        os.chdir(prevdir)
+verbose = False
+
+class HomeworkError(Exception):
+    """An error that stops provisioning; its args are the lines of the message.
+
+    Keyword arguments describe the error further and become attributes of it,
+    like the branch of a BranchExistsError.
+    """
+
+    def __init__(self, *msgs, **details):
+        super().__init__(*msgs)
+        self.__dict__.update(details)
+
+
+class RepositoryError(HomeworkError):
+    """The assignments repository is missing, invalid, or lacks a base branch."""
+
+
+class DirtyRepositoryError(RepositoryError):
+    """The repository has uncommitted changes that a checkout would disturb."""
+
+
+class BranchExistsError(HomeworkError):
+    """The assignment's branch already exists; its name is the branch attribute."""
+
+
+class ProblemBankError(HomeworkError):
+    """The problem bank is missing or cannot provide what was asked of it."""
+
+
+class UnknownAssignmentError(ProblemBankError):
+    """The problem bank has no assignment named by the assignment attribute."""
+
+
+class GitCommandError(HomeworkError):
+    """A git command failed; see the command and stderr attributes."""
+
 
+class PhaseTimeoutError(HomeworkError):
+    """A fleet phase ran out of time; its pending attribute finishes when its thread does."""
 
-def die(*msgs):
-    for msg in msgs:
-        print("\x1b[31;1m[Error]\x1b[0m " + msg, file=sys.stderr)
-    sys.exit(1)
+
+def die(*msgs, error=HomeworkError, **details):
+    raise error(*msgs, **details)
+
+
+def report_error(err):
+    for msg in err.args:
+        print("\x1b[31;1m[Error]\x1b[0m " + str(msg), file=sys.stderr)
 
 
 def log(msg):
@@ -76,6 +156,207 @@ def log(msg):
         print(":: " + msg, file=sys.stderr)
 
 
+def import_git():
+    """Import GitPython on first use and return the git package."""
+    try:
+        import git
+        import git.refs.symbolic
+    except ModuleNotFoundError:
+        die("GitPython module is not installed!",
+            "Make sure you install it first:",
+            "pip install GitPython")
+    if _profile is not None:
+        count_git_commands(git)
+    return git
+
+
+# Profiling
+
+_profile = None
+
+
+class Profiler:
+    """Collect the wall time and work done in each phase of provisioning.
+
+    Phases nest within a thread, and the files, bytes, and git processes
+    counted in a phase are included in those of the phases enclosing it.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def phase(self, name):
+        stack = self.local.__dict__.setdefault('stack', [])
+        counts = Counter()
+        stack.append(counts)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1].update(counts)
+            self.record(name, start, wall, counts, len(stack))
+
+    def record(self, name, start, wall, counts=None, depth=0):
+        """Record a phase that started at perf_counter() time start."""
+        counts = counts or Counter()
+        with self.lock:
+            self.records.append({'phase': name, 'start': start, 'wall': wall,
+                                 'files': counts['files'], 'bytes': counts['bytes'],
+                                 'git': counts['git'], 'depth': depth,
+                                 'pid': os.getpid(), 'thread': threading.get_ident()})
+
+    def count(self, **counts):
+        stack = getattr(self.local, 'stack', None)
+        if stack:
+            stack[-1].update(counts)
+
+    def take(self):
+        """Return the records collected so far, forgetting them."""
+        with self.lock:
+            records, self.records = self.records, []
+        return records
+
+
+def start_profiling():
+    """Start profiling this process, returning the new Profiler.
+
+    While profiling, the git processes that GitPython starts are counted too.
+    """
+    global _profile
+
+    _profile = Profiler()
+    if 'git' in sys.modules:
+        count_git_commands(sys.modules['git'])
+    return _profile
+
+
+def stop_profiling():
+    """Stop profiling, leaving GitPython as it was, and return the records."""
+    global _profile
+
+    records = _profile.take()
+    _profile = None
+    git = sys.modules.get('git')
+    if git is not None:
+        execute = git.cmd.Git.execute
+        git.cmd.Git.execute = getattr(execute, 'uncounted', execute)
+    return records
+
+
+def count_git_commands(git):
+    """Wrap GitPython's Git.execute to count the git processes it starts.
+
+    Only done while profiling (see start_profiling), as the change is seen by
+    every user of GitPython in the process.
+    """
+    execute = git.cmd.Git.execute
+    if hasattr(execute, 'uncounted'):
+        return
+
+    @functools.wraps(execute)
+    def counted(*args, **kwargs):
+        count(git=1)
+        return execute(*args, **kwargs)
+    counted.uncounted = execute
+    git.cmd.Git.execute = counted
+
+
+def traced(func):
+    """Profile calls of func as a phase named after it, when profiling."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _profile is None:
+            return func(*args, **kwargs)
+        with _profile.phase(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def count(**counts):
+    """Add counts of files, bytes, or git processes to the current phase."""
+    if _profile is not None:
+        _profile.count(**counts)
+
+
+def percentile(values, p):
+    """Return the pth percentile of sorted values, by the nearest-rank method."""
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+
+def phase_percentiles(records):
+    """Summarize the wall times of records by phase, in milliseconds."""
+    walls = {}
+    for r in records:
+        walls.setdefault(r['phase'], []).append(r['wall'] * 1000)
+    summary = {}
+    for phase, values in walls.items():
+        values.sort()
+        summary[phase] = {'count': len(values), 'total': sum(values),
+                          'p50': percentile(values, 50), 'p90': percentile(values, 90),
+                          'p99': percentile(values, 99), 'max': values[-1]}
+    return summary
+
+
+def report_percentiles(records):
+    """Print the per-phase percentiles of records, slowest phases first."""
+    summary = phase_percentiles(records)
+    print("{:<28} {:>6} {:>9} {:>9} {:>9} {:>9}  (ms)"
+          .format("phase", "n", "p50", "p90", "p99", "max"), file=sys.stderr)
+    for phase, s in sorted(summary.items(), key=lambda i: -i[1]['total']):
+        print("{:<28} {:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}"
+              .format(phase, s['count'], s['p50'], s['p90'], s['p99'], s['max']),
+              file=sys.stderr)
+
+
+def write_profile(records, profile_path, trace_path):
+    """Append records to profile_path as JSON lines and write them as a trace.
+
+    Start times are made relative to the earliest record. The trace, written
+    to trace_path if given, is in the Chrome trace-event format, for viewing
+    in chrome://tracing or Perfetto.
+    """
+    t0 = min((r['start'] for r in records), default=0)
+    if profile_path:
+        with open(profile_path, "a") as f:
+            for r in records:
+                f.write(json.dumps(dict(r, start=round(r['start'] - t0, 6))) + "\n")
+    if trace_path:
+        events = [{'name': r['phase'], 'ph': 'X',
+                   'ts': round((r['start'] - t0) * 1e6), 'dur': round(r['wall'] * 1e6),
+                   'pid': r['pid'], 'tid': r['thread'],
+                   'args': {k: r[k] for k in ('files', 'bytes', 'git')}}
+                  for r in records]
+        with open(trace_path, "w") as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def cache_dir(*parts):
+    """Return the path of a directory in our per-user cache, creating it.
+
+    The cache lives in $XDG_CACHE_HOME/new-homework, or ~/.cache/new-homework
+    when XDG_CACHE_HOME is not set.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    path = os.path.join(base, 'new-homework', *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_json_atomically(path, data):
+    """Write data as JSON to path, replacing any existing file atomically."""
+    tmp = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    with open(tmp, "w") as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
 def validate(repo):
     """Check if homework repository is valid. Return repo or None if invalid."""
     # Currently no rules to check
@@ -92,7 +373,7 @@ def strictly_validate(repo):
     Return a (boolean, string) pair with (valid?, reason).
     """
 
-    if 'clean-start' not in repo.refs:
+    if not has_ref(repo, 'clean-start'):
         return (False, 'repo does not have a ref named clean-start')
 
     return (True, '')
@@ -102,52 +383,107 @@ def try_repo(maybe_dir, message="Using"):
     """Check if maybe_dir is a git repository."""
     if not os.path.isdir(maybe_dir):
         return None
+    git = import_git()
     try:
-        r = Repo(maybe_dir)
+        r = git.Repo(maybe_dir)
         log("{} {} as homework repository".format(message, maybe_dir))
-    except InvalidGitRepositoryError:
+    except git.exc.InvalidGitRepositoryError:
         r = None
     return r
 
 
+HW_PREFIX = 'assignments-'
+
+
+def has_git_head(d):
+    """Cheaply check whether directory d looks like the top of a git repository."""
+    return os.path.isfile(os.path.join(d, '.git', 'HEAD')) or \
+        os.path.isfile(os.path.join(d, '.git'))
+
+
+def list_repo_candidates(dir):
+    """Return the paths of the entries of dir named like assignments-*."""
+    try:
+        return [os.path.join(dir, f) for f in os.listdir(dir) if f.startswith(HW_PREFIX)]
+    except OSError:
+        return []
+
+
+def probe_repos(candidates):
+    """Return a Repo for the first of candidates that is a git repository.
+
+    The candidates are probed in parallel, but the first valid one in the order
+    given wins, so the result does not depend on timing.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not candidates:
+        return None
+    with ThreadPoolExecutor(max_workers=min(len(candidates), 16)) as pool:
+        probes = [pool.submit(has_git_head, d) for d in candidates]
+        for d, probe in zip(candidates, probes):
+            if probe.result():
+                log("Checking dir {}".format(d))
+                r = try_repo(d, "Guessing")
+                if r is not None:
+                    for p in probes:
+                        p.cancel()
+                    return r
+    return None
+
+
 def guess_repo(starting_dir):
     """Try to find an assignment repo, looking near starting_dir and guessing.
 
     A matching directory has a name assignments-* and is a git repository.
     The search order is starting_dir, then directories in starting_dir,
     its parents, its grandparents, ~s650.
+
+    The repository found is remembered, by starting directory, in our cache,
+    and used directly next time as long as its .git/HEAD still exists.
+    Otherwise the directories are listed and their candidates probed in
+    parallel, which matters on network-mounted home directories.
     """
 
+    start = os.path.abspath(starting_dir)
+    cache_file = os.path.join(cache_dir(), "repos.json")
+    try:
+        with open(cache_file, "r") as f:
+            known = json.load(f)
+    except (OSError, ValueError):
+        known = {}
+
+    if start in known and has_git_head(known[start]):
+        r = try_repo(known[start], "Guessing")
+        if r is not None:
+            return r
+
+    from concurrent.futures import ThreadPoolExecutor
+
     home = os.environ['HOME']
-    hw_re = re.compile(r'^assignments-')
-    guess_dirs = [os.path.abspath(starting_dir),
+    guess_dirs = [start,
                   os.path.abspath(os.path.join(starting_dir, '..')),
                   os.path.abspath(os.path.join(starting_dir, '..', '..')),
                   os.path.join(home, 's750'),
                   os.path.join(home, 's650')]
 
-    # Check first where we are and directly above
-    for d, name in [(d, os.path.basename(d)) for d in guess_dirs[0:2]]:
-        if re.match(hw_re, name) and os.path.isdir(d):
-            log("Checking dir {}".format(d))
-            r = try_repo(d, "Guessing")
-            if r is not None:
-                return r
+    # Check first where we are and directly above, then their contents
+    candidates = [d for d in guess_dirs[0:2] if os.path.basename(d).startswith(HW_PREFIX)]
+    with ThreadPoolExecutor(max_workers=len(guess_dirs)) as pool:
+        for listing in pool.map(list_repo_candidates, guess_dirs):
+            candidates.extend(d for d in listing if d not in candidates)
 
-    for dir in guess_dirs:
+    r = probe_repos(candidates)
+    if r is not None:
+        known[start] = r.working_tree_dir
         try:
-            cand = os.listdir(dir)
-            for d in [os.path.join(dir, f) for f in cand if re.match(hw_re, f)]:
-                if os.path.isdir(d):
-                    log("Checking dir {}".format(d))
-                    r = try_repo(d, "Guessing")
-                    if r is not None:
-                        return r
-        except OSError:
-            pass
-    return None
+            write_json_atomically(cache_file, known)
+        except OSError as e:
+            log("Could not save repository cache: {}".format(e))
+    return r
 
 
+@traced
 def find_repo(maybe_repo, guess, cwd):
     """Find the assignments respository starting from an initial candidate.
 
@@ -163,7 +499,8 @@ def find_repo(maybe_repo, guess, cwd):
     if maybe_repo:
         repo = try_repo(maybe_repo)
         if repo is None:
-            die('Cannot find specified repository {}'.format(maybe_repo))
+            die('Cannot find specified repository {}'.format(maybe_repo),
+                error=RepositoryError)
 
     if guess and repo is None:
         repo = guess_repo(cwd)
@@ -173,10 +510,102 @@ def find_repo(maybe_repo, guess, cwd):
     return validate(repo)
 
 
+REF_PREFIXES = ['refs/heads/', 'refs/tags/', 'refs/remotes/']
+
+_ref_indexes = {}
+
+
+def read_refs(git_dir):
+    """Return a dict mapping each ref under refs/ in git_dir to its object id.
+
+    Reads packed-refs and the loose refs directly, without GitPython, in one
+    pass. Loose refs override packed ones, as in git.
+    """
+    refs = {}
+    try:
+        with open(os.path.join(git_dir, 'packed-refs'), 'r') as f:
+            for line in f:
+                if line[0] in '#^':
+                    continue
+                sha, _, ref = line.rstrip('\n').partition(' ')
+                refs[ref] = sha
+    except FileNotFoundError:
+        pass
+
+    for dirpath, _, filenames in os.walk(os.path.join(git_dir, 'refs')):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            ref = os.path.relpath(path, git_dir).replace(os.sep, '/')
+            try:
+                with open(path, 'r') as f:
+                    refs[ref] = f.read().strip()
+            except OSError:
+                pass
+    return refs
+
+
+def refs_stamp(git_dir):
+    """Summarize the state of git_dir's refs for validating a ref index."""
+    return [mtime_stamp(os.path.join(git_dir, p))
+            for p in ['packed-refs', 'refs/heads', 'refs/tags']]
+
+
+def build_ref_index(git_dir):
+    """Index the refs of git_dir for the branch name queries we make.
+
+    names maps short ref names, as GitPython names them (e.g. master, v1.0,
+    origin/master), to full ref names. parts maps the lower-cased root of each
+    vignette branch root-n to (n, branch name, root) for the branch with the
+    largest n.
+    """
+    names = {}
+    parts = {}
+    for ref in read_refs(git_dir):
+        for prefix in REF_PREFIXES:
+            if ref.startswith(prefix):
+                names.setdefault(ref[len(prefix):], ref)
+                break
+        if not ref.startswith('refs/heads/'):
+            continue
+        branch = ref[len('refs/heads/'):]
+        root, _, n = branch.rpartition('-')
+        if root and n.isdigit():
+            key = root.lower()
+            if key not in parts or int(n) > parts[key][0]:
+                parts[key] = (int(n), branch, root)
+    return {'names': names, 'parts': parts}
+
+
+def ref_index(repo):
+    """Return the ref index of repo, reading its refs again only if they changed."""
+    return ref_index_at(repo.common_dir)
+
+
+def ref_index_at(git_dir):
+    """Return the ref index of the repository whose (common) git dir is git_dir."""
+    stamp = refs_stamp(git_dir)
+    cached = _ref_indexes.get(git_dir)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, build_ref_index(git_dir))
+        _ref_indexes[git_dir] = cached
+    return cached[1]
+
+
+def forget_refs(repo):
+    """Drop the cached ref index of repo, after we change its refs."""
+    _ref_indexes.pop(repo.common_dir, None)
+
+
+def has_ref(repo, name):
+    """Return whether repo has a branch, tag, or remote branch called name."""
+    return name in ref_index(repo)['names']
+
+
 def hw_branch_exists(repo, name):
     """Return hw branch ref if it exists, or False."""
-    if name in repo.refs:
-        return repo.refs[name]
+    ref = ref_index(repo)['names'].get(name)
+    if ref:
+        return import_git().refs.symbolic.SymbolicReference.from_path(repo, ref)
     return False
 
 
@@ -197,18 +626,12 @@ def auto_branch_name(repo, name, suffix=None):
     sequel to an existing branch.
     """
 
-    branch_rx = re.compile(r'(' + name + r')(?:-(\d+))?$', flags=re.IGNORECASE)
-    prev = []
+    prev = ref_index(repo)['parts'].get(name.lower())
     base_name = None
     exercise_no = None
 
-    for b in repo.branches:
-        m = re.match(branch_rx, b.name)
-        if m and m.group(2):
-            prev.append((b.name, m.group(1), int(m.group(2))))
-
     if prev:
-        base_name, root, M = sorted(prev, key=lambda x: x[2], reverse=True)[0]
+        M, base_name, root = prev
 
         if suffix is None or suffix == 0:
             exercise_no = M + 1
@@ -230,7 +653,8 @@ def auto_branch_name(repo, name, suffix=None):
     return (hw_name, base_name, exercise_no, sequel)
 
 
-def branch_base_dir_names(repo, name, base, is_vignette, num_parts):
+@traced
+def branch_base_dir_names(repo, name, base, is_vignette, num_parts, suffix=None):
     """Set the names for the hw branch, base branch, and hw documents/directory.
 
     Parameters:
@@ -239,6 +663,7 @@ def branch_base_dir_names(repo, name, base, is_vignette, num_parts):
     + base        -- base branch/tag to branch from
     + is_vignette -- is this a vignette?
     + num_parts   -- number of parts in the vignette (1 for stand-alones)
+    + suffix      -- vignette part to create, if not the next one
 
     Return tuple (branch_name, base_name, doc_name, auto-sequel-branch?)
     """
@@ -247,7 +672,7 @@ def branch_base_dir_names(repo, name, base, is_vignette, num_parts):
     sequel = False  # Are we building on a previous exercise/branch?
 
     if is_vignette:
-        hw_name, base_name, exercise_no, sequel = auto_branch_name(repo, name)
+        hw_name, base_name, exercise_no, sequel = auto_branch_name(repo, name, suffix)
 
         if exercise_no > num_parts:
             die("The vignette {} only has {} exercises; cannot create a branch ".format(name, num_parts),
@@ -261,7 +686,7 @@ def branch_base_dir_names(repo, name, base, is_vignette, num_parts):
 
 def make_hw_directory(hw_dir, hdir_name):
     try:
-        os.mkdir(hdir_name)
+        os.mkdir(hw_dir)
         log("Creating directory for work on {}".format(hdir_name))
     except FileExistsError:
         print("Warning: directory {} already exists; continuing anyway..."
@@ -274,20 +699,23 @@ def make_hw_directory(hw_dir, hdir_name):
         die("Cannot write file in homework directory")
 
 
+@traced
 def make_hw_branch(repo, name, base):
     """Create (if new) and checkout the homework branch name."""
     b = hw_branch_exists(repo, name)
     if b:
-        repo.refs[name].checkout()
+        b.checkout()
         return b
 
-    if base not in repo.refs:
-        die("Base branch {} does not exist".format(base))
+    if not has_ref(repo, base):
+        die("Base branch {} does not exist".format(base), error=RepositoryError)
 
     repo.git.checkout(base, b=name)
-    return repo.refs[name]
+    forget_refs(repo)
+    return hw_branch_exists(repo, name)
 
 
+@traced
 def check_problem_bank(repo_dir, problem_base):
     """Find the local problem bank and check that it is accessible."""
     problem_bank = (problem_base and os.path.abspath(problem_base)) or \
@@ -295,275 +723,2737 @@ def check_problem_bank(repo_dir, problem_base):
 
     if not problem_bank or not os.access(problem_bank, os.R_OK):
         problem_bank = ''
-        die("Cannot find problem-bank repository; see --problems option."
-            "The problem-bank should be in the same directory as your assignments repository.")
+        die("Cannot find problem-bank repository; see --problems option.",
+            "The problem-bank should be in the same directory as your assignments repository.",
+            error=ProblemBankError)
 
     return problem_bank
 
 
-def install_problem(name, hw_dir, problem_bank):
-    """Move assignment description and related files into our repository.
+PROBLEM_INDEX_VERSION = 2
+BANK_DIRS = ['All', 'Data', 'Resources', 'Skel', '.skel']
 
-    If problem_bank is empty, the directory is missing; note in log.
+_problem_indexes = {}
+
+
+def mtime_stamp(path):
+    """Return the modification time of path in ns, or None if it is missing."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
 
-    Return list of installed files and directories (not recursively)
-    relative to repository root directory.
 
+def bank_stamp(problem_bank):
+    """Summarize the state of the problem bank's top level for cache validation.
+
+    Adding or removing an assignment changes the mtime of points.csv or of one
+    of the top-level bank directories, so if none of these have changed the
+    cached index can be used as is.
     """
-    if not problem_bank:
-        print("Warning: Missing problem bank, skipping file install.")
-        print("To install later, run with --warn-if-exists and, if appropriate, ")
-        print("use the --problems option to specify location of the problem bank.")
+    points = os.stat(os.path.join(problem_bank, "points.csv"))
+    stamp = {'points.csv': [points.st_mtime_ns, points.st_size]}
+    for d in BANK_DIRS:
+        stamp[d] = mtime_stamp(os.path.join(problem_bank, d))
+    return stamp
+
+
+def assignment_stamp(name, problem_bank):
+    """Return the mtimes of the problem bank entries belonging to name."""
+    return [mtime_stamp(os.path.join(problem_bank, "All", name + ".pdf")),
+            mtime_stamp(os.path.join(problem_bank, "Data", name)),
+            mtime_stamp(os.path.join(problem_bank, "Resources", name)),
+            mtime_stamp(os.path.join(problem_bank, "Skel", name))]
+
+
+def list_languages(skel_dir):
+    """Return the sorted template languages available in skel_dir."""
+    try:
+        return sorted(d for d in os.listdir(skel_dir)
+                      if os.path.isdir(os.path.join(skel_dir, d)))
+    except OSError:
         return []
 
-    pdf = "{}.pdf".format(name)
-    base = ['Data', 'Resources']
-    copies = [(os.path.join(problem_bank, d, name),
-               os.path.join(hw_dir, d),
-               d) for d in base]
-    installed = []
-
-    try:
-        shutil.copyfile(os.path.join(problem_bank, "All", pdf),
-                        os.path.join(hw_dir, pdf))
-        installed.append(os.path.join(name, pdf))
-    except IOError as e:
-        print("Warning: Could not install PDF file from problem bank: "
-              "{e.strerror} (errno={e.errno}) file {e.filename}.".format(e=e),
-              file=sys.stderr)
 
-    for src, dest, dirname in copies:
-        if os.path.isdir(src) and not os.path.exists(dest):
-            try:
-                shutil.copytree(src, dest)
-                installed.append(os.path.join(name, dirname))
-            except shutil.Error as errs:
-                for (s, d, why) in errs.args[0]:
-                    print("Warning: could not copy {s} to {d} ({why})"
-                          .format(s=s, d=d, why=why), file=sys.stderr)
-    return installed
+def index_assignment(name, parts, stamp, problem_bank):
+    """Scan the problem bank for assignment name and return its index entry.
 
+    The entry records the total size of the files installed for the
+    assignment, so that their I/O can be budgeted before reading them.
+    """
+    total = 0
+    pdf = os.path.join(problem_bank, "All", name + ".pdf")
+    sources = [pdf] if stamp[0] is not None else []
+    dirs = [d for d, st in zip(['Data', 'Resources'], stamp[1:3]) if st is not None]
+    for d in dirs:
+        for dirpath, _, filenames in os.walk(os.path.join(problem_bank, d, name)):
+            sources.extend(os.path.join(dirpath, filename) for filename in filenames)
+
+    for path in sources:
+        try:
+            total += os.stat(path).st_size
+        except OSError:
+            continue
 
-def safe_assignment_name(name):
-    """Convert an assignment name into one safe to use as a filename.
+    return {'parts': parts,
+            'pdf': stamp[0] is not None,
+            'dirs': dirs,
+            'languages': list_languages(os.path.join(problem_bank, "Skel", name)),
+            'bytes': total,
+            'stamp': stamp}
 
-    This is used for template files, e.g. unit testing and source files. The
-    primary concern is that assignment names contain hyphens, but filenames with
-    hyphens cannot be imported in Python.
+
+def read_problem_names(problem_bank):
+    """Return a Counter of assignment names listed in the bank's points.csv."""
+    import csv
+
+    with open(os.path.join(problem_bank, "points.csv"), "r") as f:
+        r = csv.reader(f)
+        next(r, None) # skip header row
+        return Counter(row[0] for row in r if row)
+
+
+def build_problem_index(problem_bank, old=None):
+    """Build the index of problem_bank, reusing unchanged entries from old."""
+    stamp = bank_stamp(problem_bank)
+    old_problems = (old or {}).get('problems', {})
+    problems = {}
+    rebuilt = 0
+
+    for name, parts in read_problem_names(problem_bank).items():
+        a_stamp = assignment_stamp(name, problem_bank)
+        entry = old_problems.get(name)
+        if entry and entry['stamp'] == a_stamp:
+            entry['parts'] = parts
+        else:
+            entry = index_assignment(name, parts, a_stamp, problem_bank)
+            rebuilt += 1
+        problems[name] = entry
+
+    log("Indexed problem bank {}: {} assignments, {} rescanned"
+        .format(problem_bank, len(problems), rebuilt))
+    return {'version': PROBLEM_INDEX_VERSION,
+            'bank': problem_bank,
+            'stamp': stamp,
+            'languages': list_languages(os.path.join(problem_bank, ".skel")),
+            'problems': problems}
+
+
+@traced
+def problem_index(problem_bank):
+    """Return the index of the problem bank, rebuilding it only if stale.
+
+    The index maps each assignment name to its number of parts, whether it has
+    a PDF, which of the Data and Resources directories it has, the template
+    languages in Skel, and its total size in bytes. It is kept in our cache
+    directory and validated against the mtimes of points.csv and the bank
+    directories; when those change, only assignments whose own files changed
+    are rescanned. Look entries up with problem_entry, which
+    also catches changes inside an assignment's own directories.
     """
+    problem_bank = os.path.abspath(problem_bank)
+    index = _problem_indexes.get(problem_bank)
+    if index is not None:
+        return index
 
-    return name.replace("-", "_").strip()
+    path = problem_index_path(problem_bank)
+    try:
+        with open(path, "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = None
+
+    if index is None or index.get('version') != PROBLEM_INDEX_VERSION or \
+       index.get('stamp') != bank_stamp(problem_bank):
+        index = build_problem_index(problem_bank, index)
+        try:
+            write_json_atomically(path, index)
+        except OSError as e:
+            log("Could not save problem bank index: {}".format(e))
 
+    _problem_indexes[problem_bank] = index
+    return index
 
-def install_template(language, hdir_name, problem_bank):
-    """Install a template into the repository.
 
-    The template contains a source file and a unit test file, with correct names
-    so the student can easily run tests and so CI knows how to find the tests.
+def problem_index_path(problem_bank):
+    key = hashlib.sha1(problem_bank.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir("banks"), key + ".json")
 
-    We first look in the assignment directory in the problem bank for a template
-    specific to this assignment; if no templates exist, we look in the problem
-    bank's `.skel` directory.
+
+def problem_entry(name, problem_bank):
+    """Return the index entry of assignment name, or None if the bank lacks it.
+
+    The index as a whole is only validated against the top of the bank, which
+    does not change when, say, Skel/name/r is added. So the entry is checked
+    against its own assignment_stamp, and rescanned (and the index saved) if
+    it is out of date.
     """
+    problem_bank = os.path.abspath(problem_bank)
+    index = problem_index(problem_bank)
+    entry = index['problems'].get(name)
+    if entry is None:
+        return None
+    stamp = assignment_stamp(name, problem_bank)
+    if entry['stamp'] != stamp:
+        log("Rescanning {} in problem bank {}".format(name, problem_bank))
+        entry = index_assignment(name, entry['parts'], stamp, problem_bank)
+        index['problems'][name] = entry
+        try:
+            write_json_atomically(problem_index_path(problem_bank), index)
+        except OSError as e:
+            log("Could not save problem bank index: {}".format(e))
+    return entry
 
-    if language == "none":
-        return
 
-    template_dirs = [
-        os.path.join(problem_bank, "Skel", hdir_name, language.lower()),
-        os.path.join(problem_bank, ".skel", language.lower())
-    ]
+class ProblemBank(os.PathLike):
+    """A problem bank and its index, for provisioning from Python.
 
-    safename = safe_assignment_name(hdir_name)
+    A ProblemBank can be passed wherever a problem_bank path is expected. Its
+    index is loaded once and then shared by every call that uses the bank, so
+    long-running callers should call refresh() after pulling bank updates.
+    """
 
-    for template_dir in template_dirs:
-        if not os.path.exists(template_dir):
-            continue
+    def __init__(self, path):
+        path = os.fspath(path)
+        if not path:
+            die("No problem bank given.", error=ProblemBankError)
+        self.path = check_problem_bank(None, path)
 
-        for dirpath, _, filenames in os.walk(template_dir):
-            for filename in filenames:
-                contents = open(os.path.join(dirpath, filename), "r").read().replace("ASSIGN", safename)
+    @classmethod
+    def beside(cls, repo, problems=None):
+        """Return the problem bank for repo: problems, or its sibling problem-bank."""
+        return cls(check_problem_bank(repo.working_tree_dir, problems))
+
+    def __fspath__(self):
+        return self.path
+
+    def __repr__(self):
+        return "ProblemBank({!r})".format(self.path)
+
+    def __contains__(self, name):
+        return name in self.index['problems']
+
+    @property
+    def index(self):
+        return problem_index(self.path)
+
+    @property
+    def languages(self):
+        return self.index['languages']
+
+    def names(self):
+        """Return the names of the assignments in the bank, sorted."""
+        return sorted(self.index['problems'])
+
+    def info(self, name):
+        """Return (is-vignette?, num-parts) for assignment name, as get_problem_info."""
+        return get_problem_info(name, self.path)
+
+    def refresh(self):
+        """Forget the loaded index, so the next use revalidates it against the bank."""
+        _problem_indexes.pop(self.path, None)
+
+
+# Packed problem banks
+
+PACK_NAME = ".bank-pack"
+PACK_MAGIC = b"NHPACK01"
+PACK_HEADER = struct.Struct("<8sQQ")    # magic, index offset, index length
+PACK_VERSION = 3
+
+_bank_packs = {}
+
+
+class PackMember:
+    """A file in a packed problem bank, read from the pack's memory map."""
+
+    def __init__(self, pack, path, offset, size, mode, mtime, sha256, offsets):
+        self.pack = pack
+        self.path = path
+        self.offset = offset
+        self.size = size
+        self.mode = mode
+        self.mtime = mtime
+        self.sha256 = sha256
+        self.offsets = offsets
+
+    def __repr__(self):
+        return "PackMember({!r}, {!r})".format(self.pack.path, self.path)
+
+    def chunks(self):
+        """Yield the contents of the member as views of the map, COPY_BUFFER at a time."""
+        view = memoryview(self.pack.map)
+        end = self.offset + self.size
+        for start in range(self.offset, end, COPY_BUFFER):
+            yield view[start:min(start + COPY_BUFFER, end)]
+
+    def open(self):
+        """Return a binary file object for the contents of the member."""
+        return io.BufferedReader(ChunkReader(self.chunks()), COPY_BUFFER)
+
+    def extract(self, dest):
+        """Write the member to dest with its permission bits and mtime.
+
+        Returns the number of bytes written.
+        """
+        with open(dest, "wb") as f:
+            f.write(memoryview(self.pack.map)[self.offset:self.offset + self.size])
+        os.chmod(dest, self.mode)
+        os.utime(dest, ns=(self.mtime, self.mtime))
+        return self.size
+
+
+class BankPack:
+    """A problem bank packed by pack_bank into one file with an offset index.
+
+    The index maps the path of each file in the bank, relative to its root, to
+    its offset and size in the pack, its mode, mtime, and SHA-256, and for
+    templates the offsets of their placeholders. Paths are kept sorted, so the
+    files of an assignment directory are found by bisection.
+    """
+
+    def __init__(self, path):
+        import mmap
+
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, offset, length = PACK_HEADER.unpack_from(self.map)
+        if magic != PACK_MAGIC:
+            raise ValueError("{} is not a problem bank pack".format(path))
+        self.index = json.loads(bytes(self.map[offset:offset + length]))
+        self.paths = sorted(self.index['files'])
+
+    def member(self, path):
+        """Return the member at path in the bank, or None if it is not packed."""
+        entry = self.index['files'].get(path)
+        return entry and PackMember(self, path, *entry)
+
+    def members(self, directory):
+        """Return the members in directory of the bank and its subdirectories."""
+        from bisect import bisect_left
+
+        prefix = directory.rstrip('/') + '/'
+        found = []
+        for path in self.paths[bisect_left(self.paths, prefix):]:
+            if not path.startswith(prefix):
+                break
+            found.append(self.member(path))
+        return found
+
+
+def bank_head(problem_bank):
+    """Return the commit checked out in problem_bank, or None if it is not a git checkout.
+
+    Reads .git directly, at the cost of a few small reads rather than a git
+    process.
+    """
+    dirs = find_git_dirs(problem_bank)
+    if dirs is None:
+        return None
+    git_dir, common_dir = dirs
+    try:
+        with open(os.path.join(git_dir, 'HEAD'), "r") as f:
+            head = f.read().strip()
+    except OSError:
+        return None
+    if not head.startswith('ref:'):
+        return head
+    ref = head[len('ref:'):].strip()
+    try:
+        with open(os.path.join(common_dir, ref), "r") as f:
+            return f.read().strip()
+    except OSError:
+        return read_refs(common_dir).get(ref)
+
+
+def bank_pack(problem_bank):
+    """Return the BankPack of problem_bank, or None if it has no current pack.
+
+    A pack is current if the bank's checked-out commit (see bank_head) and
+    top level (see bank_stamp) are as they were when it was made, which
+    takes a few stats and reads however many files the bank has. Otherwise
+    files are read from the bank's directories as usual. Packs stay open,
+    and are reopened when rebuilt.
+    """
+    path = os.path.join(problem_bank, PACK_NAME)
+    mtime = mtime_stamp(path)
+    if mtime is None:
+        return None
+
+    pack = _bank_packs.get(problem_bank)
+    if pack is None or pack.mtime != mtime:
+        try:
+            pack = BankPack(path)
+        except (OSError, ValueError, struct.error) as e:
+            log("Ignoring problem bank pack {}: {}".format(path, e))
+            return None
+        pack.mtime = mtime
+        _bank_packs[problem_bank] = pack
+
+    if pack.index.get('version') != PACK_VERSION or \
+       pack.index['head'] != bank_head(problem_bank) or \
+       pack.index['stamp'] != bank_stamp(problem_bank):
+        log("Ignoring out-of-date problem bank pack {}; rebuild it with --pack-bank"
+            .format(path))
+        return None
+    return pack
 
-                open(os.path.join(hdir_name,
-                                  filename.replace("ASSIGN", safename)), "w").write(contents)
 
+@traced
+def pack_bank(problem_bank):
+    """Pack the files of problem_bank into its PACK_NAME file, replacing any old pack.
+
+    If the bank is a git checkout, the pack is listed in its info/exclude, so
+    that it does not show as untracked. Return the number of files and bytes
+    packed.
+    """
+    exclude_from_bank(problem_bank, "/" + PACK_NAME + "*")
+    files = {}
+    tmp = "{}.{}.tmp".format(os.path.join(problem_bank, PACK_NAME), os.getpid())
+    with open(tmp, "wb") as out:
+        out.write(PACK_HEADER.pack(PACK_MAGIC, 0, 0))
+        for d in BANK_DIRS:
+            for dirpath, dirnames, filenames in os.walk(os.path.join(problem_bank, d)):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    src = os.path.join(dirpath, filename)
+                    rel = os.path.relpath(src, problem_bank).replace(os.sep, '/')
+                    st = os.stat(src)
+                    offset = out.tell()
+                    h = hashlib.sha256()
+                    with open(src, "rb") as f:
+                        for chunk in iter(lambda: f.read(COPY_BUFFER), b""):
+                            h.update(chunk)
+                            out.write(chunk)
+                    is_template = rel.startswith(('Skel/', '.skel/'))
+                    files[rel] = [offset, out.tell() - offset, stat.S_IMODE(st.st_mode),
+                                  st.st_mtime_ns, h.hexdigest(),
+                                  find_placeholders(src) if is_template else None]
+        index = json.dumps({'version': PACK_VERSION,
+                            'head': bank_head(problem_bank),
+                            'stamp': bank_stamp(problem_bank),
+                            'files': files}, separators=(',', ':')).encode()
+        offset = out.tell()
+        out.write(index)
+        out.seek(0)
+        out.write(PACK_HEADER.pack(PACK_MAGIC, offset, len(index)))
+    os.replace(tmp, os.path.join(problem_bank, PACK_NAME))
+    return len(files), offset - PACK_HEADER.size
+
+
+def exclude_from_bank(problem_bank, pattern):
+    """Add pattern to the info/exclude of problem_bank, if it is a git checkout."""
+    dirs = find_git_dirs(problem_bank)
+    if dirs is None:
+        return
+    path = os.path.join(dirs[1], "info", "exclude")
+    try:
+        with open(path, "r") as f:
+            text = f.read()
+    except FileNotFoundError:
+        text = ""
+    if pattern in text.splitlines():
         return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(("\n" if text and not text.endswith("\n") else "") + pattern + "\n")
 
-    die("No template exists for --language={}".format(language))
 
+# Problem bank remotes
 
-def get_problem_info(name, problem_bank):
-    """Check if the problem exists in the bank.
+REMOTE_BANK_PATTERNS = ['/points.csv', '/.skel/']
 
-    Dies if the problem does not exist. Return a tuple:
-    (is-vignette?, num-parts)
-    where non-vignettes have only 1 part.
+
+def assignment_patterns(name):
+    """Return the sparse-checkout patterns for the problem bank files of name."""
+    return ['/All/{}.pdf'.format(name), '/Data/{}/'.format(name),
+            '/Resources/{}/'.format(name), '/Skel/{}/'.format(name)]
+
+
+@contextmanager
+def locked(path):
+    """Hold an exclusive lock on the file path, where the platform supports it."""
+    with open(path, "a") as f:
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@traced
+def remote_problem_bank(url, names):
+    """Return a local problem bank holding assignments names, fetched from url.
+
+    The bank is a blobless partial clone of url, kept in our cache directory,
+    with a sparse checkout of points.csv, .skel, and the files of the
+    assignments asked for so far; only the blobs of those files are ever
+    downloaded. Each call fetches new commits, falling back to the cached
+    clone if the remote cannot be reached. The remote must allow partial
+    clones (uploadpack.allowFilter), as the common git hosts do; otherwise git
+    warns and clones every blob.
     """
+    if '://' not in url and ':' not in url.split('/')[0]:
+        # A local path, for which the local transport would ignore --filter
+        url = 'file://' + os.path.abspath(url)
+    cache = cache_dir("remotes", hashlib.sha1(url.encode()).hexdigest()[:16])
+    bank = os.path.join(cache, "bank")
+
+    with locked(os.path.join(cache, "lock")):
+        if not os.path.isdir(os.path.join(bank, ".git")):
+            log("Cloning problem bank {} without blobs".format(url))
+            run_git(cache, 'clone', '--quiet', '--filter=blob:none', '--no-checkout', url, bank)
+        else:
+            try:
+                run_git(bank, 'fetch', '--quiet', 'origin')
+            except GitCommandError as e:
+                log("Using cached problem bank; {}".format(e.args[0]))
 
-    f = open(os.path.join(problem_bank, "points.csv"), "r")
-    r = csv.reader(f)
-    next(r) # skip header row
+        try:
+            with open(os.path.join(bank, ".git", "info", "sparse-checkout"), "r") as f:
+                patterns = f.read().split()
+        except OSError:
+            patterns = []
+        wanted = REMOTE_BANK_PATTERNS + [p for name in names for p in assignment_patterns(name)]
+        if not set(wanted) <= set(patterns):
+            run_git(bank, 'sparse-checkout', 'set', '--no-cone',
+                    *sorted(set(patterns) | set(wanted)))
+        run_git(bank, 'reset', '--quiet', '--hard', 'origin/HEAD')
+    log("Using problem bank {} from {}".format(bank, url))
+    return bank
 
-    problems = [row[0] for row in r]
-    f.close()
 
-    count = problems.count(name)
+INSTALL_MODES = ['copy', 'link']
 
-    if count == 0:
-        die("Cannot find an assignment named '{}' in the problem bank.".format(name),
-            "The name must be spelled exactly as in the problem-bank repo.",
-            "Or the assignment is new and you did not pull the latest problem-bank updates.")
+DEFAULT_JOBS = min(32, 2 * (os.cpu_count() or 1))
+COPY_CHUNK = 64 << 20    # bytes per copy_file_range call
+COPY_BUFFER = 1 << 20    # buffer size when copying through user space
 
-    return count > 1, count
+# ioctl request to share the extents of one file with another (Linux reflink)
+FICLONE = 0x40049409
 
+_object_hashes = {}
+_object_hashes_lock = threading.Lock()    # installs may run in threads (--fleet)
+_object_hashes_save_lock = threading.Lock()    # saves write their snapshots in order
 
-# Main Script
 
-parser = argparse.ArgumentParser(description="Install a new homework "
-                                 "assignment to the repository.",
-                                 formatter_class=argparse.RawDescriptionHelpFormatter,
-                                 epilog=__doc__[__doc__.index('\n'):])
-
-parser.add_argument("-b", "--base",
-                    type=str,
-                    default='',
-                    help="Starting point at which to create the new assignment branch. "
-                    "Defaults to master, the tip of the master branch. Useful if you "
-                    "need to manually set up a vignette.")
-
-parser.add_argument("-g", "--guess-repo",
-                    default=False,
-                    action='store_true',
-                    help="If no repo is specified on the command line, "
-                    "attempt to find it nearby or in a few likely "
-                    "directories below the user's HOME.")
-
-parser.add_argument("--no-commit",
-                    default=False,
-                    action='store_true',
-                    help="Skip initial commit on assignment branch.")
-
-parser.add_argument("--no-install",
-                    default=False,
-                    action='store_true',
-                    help="Skip installation of assignment files.")
-
-parser.add_argument("-p", "--problems",
-                    type=str,
-                    default="",
-                    help="Path of problem-bank repository directory. "
-                    "If not supplied, use ../problem-bank from the homework repo.")
-
-parser.add_argument("-r", "--repo",
-                    type=str,
-                    default="",
-                    help="Path to assignments repository directory. "
-                    "If not supplied, use a guessed directory if -g option"
-                    "is supplied, or the current directory otherwise.")
-
-parser.add_argument("-v", "--verbose",
-                    default=False,
-                    action='store_true',
-                    help="Provide a log of actions taken to standard error.")
-
-parser.add_argument("--version",
-                    action='version',
-                    version='%(prog)s ' + __version__,
-                    help="Show version information and exit.")
-
-parser.add_argument("-w", "--warn-if-exists",
-                    default=False,
-                    action='store_true',
-                    help="Warn without failure if homework branch already exists.")
-
-parser.add_argument("language",
-                    help="Language you will use for the assignment. "
-                    "The script will install a simple template for that language, "
-                    "if it is supported and --no-install is not passed. Valid "
-                    "options are 'r', 'python', or 'none' to install no template.")
-
-parser.add_argument("assignment",
-                    type=str,
-                    help="Name of the homework assignment to create. Use the "
-                    "official name from the homework repository, like "
-                    "test-this or cow-proximity.")
-
-args = parser.parse_args()
-verbose = args.verbose
-aname = args.assignment
-
-cwd = os.getcwd()
-
-# Find and check the homework repository
-repo = find_repo(args.repo, args.guess_repo, cwd)
-if repo is None:
-    die("Could not find a valid assignments repository.",
-        "Are you running this command from inside your assignments repository?")
-
-valid, why = strictly_validate(repo)
-if not valid:
-    die("Repository '{0}' fails strict validity checks ({1}).".format(repo.working_tree_dir, why),
-        "If this is assessment incorrect, consider using --skip-checks.")
-
-# Sanity-check the problem bank and the assignment they requested.
-problem_bank = check_problem_bank(repo.working_tree_dir, args.problems)
-is_vignette, num_parts = get_problem_info(aname, problem_bank)
-
-if repo.is_dirty():
-    die("Your repository has uncommitted changes.",
-        "You must commit or stash all changes before creating a new branch.")
-
-hw_branch, base, hdir_name, sequelp = \
-    branch_base_dir_names(repo, aname, args.base or "master", is_vignette,
-                          num_parts)
-
-branch_exists = hw_branch_exists(repo, hw_branch)
-if branch_exists:
-    if args.warn_if_exists:
-        print("Branch {} already exists, continuing anyway."
-              .format(hw_branch), file=sys.stderr)
-    else:
-        branch_exists.checkout()
-        die("You already have a branch named {}.".format(hw_branch),
-            "Checking out branch and exiting with no other action taken.",
-            "To continue, re-run with --warn-if-exists; "
-            "see options --no-install and --no-commit.")
+def object_store():
+    """Return the directory of the local content-addressed object store."""
+    return cache_dir("objects")
 
-hw_dir = os.path.join(repo.working_tree_dir, hdir_name)
 
-# Create the branch, install relevant files, and make initial commit
-with cd(repo.working_tree_dir):
-    branch = make_hw_branch(repo, hw_branch, base)
+def load_object_cache(name):
+    """Return the object store's cache called name, reading name.json on first use.
 
-    if not sequelp:
-        make_hw_directory(hw_dir, hdir_name)
+    Call with _object_hashes_lock held, and call mark_object_cache after
+    changing it.
+    """
+    if name not in _object_hashes:
+        try:
+            with open(os.path.join(object_store(), name + ".json"), "r") as f:
+                _object_hashes[name] = json.load(f)
+        except (OSError, ValueError):
+            _object_hashes[name] = {}
+    return _object_hashes[name]
+
+
+def mark_object_cache(name):
+    """Note that the object store's cache name needs saving. Call with the lock held."""
+    _object_hashes.setdefault('dirty', set()).add(name)
+
+
+def load_object_hashes():
+    """Return the cache of content hashes of problem bank files.
+
+    Maps absolute source path to [size, mtime_ns, sha256], so that a file is
+    only read and hashed again when it changes. Call with _object_hashes_lock
+    held.
+    """
+    return load_object_cache('hashes')
+
+
+def load_object_stamps():
+    """Return the [size, mtime_ns] of each stored object, keyed by its SHA-256.
+
+    These are recorded as each object is stored, so that one changed since
+    (through a hard link into a repository) is noticed. Call with
+    _object_hashes_lock held.
+    """
+    return load_object_cache('stamps')
 
-        if not args.no_install:
-            files = install_problem(hdir_name, hw_dir, problem_bank)
-            log('Installed files: {}'.format(", ".join(files)))
 
-            install_template(args.language, hdir_name, problem_bank)
+def save_object_hashes():
+    """Write the object store's changed caches back to it.
 
-        if not args.no_commit:
-            # Add a clean initial commit on the branch with the installed files
+    Saves are serialized, so that a snapshot taken earlier is never written
+    over a later one.
+    """
+    with _object_hashes_save_lock:
+        with _object_hashes_lock:
+            dirty = {name: dict(_object_hashes[name]) for name in _object_hashes.pop('dirty', ())}
+        for name, data in sorted(dirty.items()):
             try:
-                repo.index.add([hdir_name])
-            except OSError as err:
-                print(err.filename, err.errno)
-                die("Cannot stage installed files in repository", err)
-            repo.index.commit("{}".format(hw_branch))
-            log("Committing initial state of work on branch {}.".format(hw_branch))
-    else:
-        log("Sequel branch {} created off branch {}.".format(hw_branch, base))
-        log("No commit made on sequel branch {}.".format(hw_branch))
+                write_json_atomically(os.path.join(object_store(), name + ".json"), data)
+            except OSError as e:
+                with _object_hashes_lock:
+                    mark_object_cache(name)
+                log("Could not save object {} cache: {}".format(name, e))
+
+
+def file_sha256(path):
+    """Return the hex SHA-256 digest of the contents of path."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def source_sha256(src):
+    """Return the SHA-256 of problem bank file src, from the hash cache if current."""
+    if isinstance(src, PackMember):
+        return src.sha256
+    st = os.stat(src)
+    key = os.path.abspath(src)
+    with _object_hashes_lock:
+        known = load_object_hashes().get(key)
+    if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+        return known[2]
+    digest = file_sha256(src)
+    with _object_hashes_lock:
+        load_object_hashes()[key] = [st.st_size, st.st_mtime_ns, digest]
+        mark_object_cache('hashes')
+    return digest
+
+
+def record_object(obj, digest, st=None):
+    """Record the size and mtime of the stored object obj, whose SHA-256 is digest."""
+    st = st or os.stat(obj)
+    with _object_hashes_lock:
+        load_object_stamps()[digest] = [st.st_size, st.st_mtime_ns]
+        mark_object_cache('stamps')
+
+
+def object_intact(obj, digest):
+    """Return whether the stored object obj exists and still has SHA-256 digest.
+
+    Objects are hard linked into repositories, where they can be made writable
+    and edited in place. One whose size and mtime are as recorded when it was
+    stored is trusted; any other is hashed again.
+    """
+    try:
+        st = os.stat(obj)
+    except FileNotFoundError:
+        return False
+    with _object_hashes_lock:
+        known = load_object_stamps().get(digest)
+    if known == [st.st_size, st.st_mtime_ns]:
+        return True
+    if file_sha256(obj) != digest:
+        log("Replacing object {}, which was changed after it was stored".format(obj))
+        return False
+    record_object(obj, digest, st)
+    return True
+
+
+def store_object(src):
+    """Add the file src to the object store and return the object's path.
+
+    Objects are named by the SHA-256 of their contents and are made read-only,
+    since they may be shared by hard links between several repositories. An
+    object that has been changed anyway is replaced, leaving the changed file
+    to the repositories that already have it.
+    """
+    import shutil
+
+    digest = source_sha256(src)
+    obj = os.path.join(object_store(), digest[:2], digest[2:])
+    if not object_intact(obj, digest):
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        tmp = "{}.{}.{}.tmp".format(obj, os.getpid(), threading.get_ident())
+        if isinstance(src, PackMember):
+            src.extract(tmp)
+        else:
+            shutil.copyfile(src, tmp)
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, obj)
+        record_object(obj, digest)
+    return obj
+
+
+def reflink(src, dest):
+    """Create dest as a copy-on-write clone of src. Raises OSError if unsupported."""
+    import fcntl
+
+    with open(src, "rb") as s, open(dest, "xb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            os.unlink(dest)
+            raise
+
+
+def place_object(obj, dest):
+    """Place a stored object at dest by reflink, hard link, or copy, in that order.
+
+    A hard link shares the file with the object store and every other
+    repository it was placed in; see --install-mode.
+    """
+    import shutil
+
+    try:
+        reflink(obj, dest)
+        return 'reflink'
+    except (OSError, ImportError):
+        pass
+    try:
+        os.link(obj, dest)
+        return 'link'
+    except OSError:
+        pass
+    shutil.copyfile(obj, dest)
+    return 'copy'
+
+
+def link_file(src, dest):
+    """Install the file src at dest through the object store.
+
+    Returns the number of bytes installed.
+    """
+    obj = store_object(src)
+    place_object(obj, dest)
+    return os.stat(obj).st_size
+
+
+def copy_file(src, dest):
+    """Copy src to dest with its permission bits and times, like shutil.copy2.
+
+    The data is moved with copy_file_range where the platform supports it, so
+    the kernel (or a network filesystem's server) copies it without passing it
+    through user space; otherwise it is copied with large buffered reads.
+    Returns the number of bytes copied. A PackMember is extracted from its pack.
+    """
+    import shutil
+
+    if isinstance(src, PackMember):
+        return src.extract(dest)
+
+    copied = 0
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdst:
+        try:
+            while True:
+                n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_CHUNK)
+                if n == 0:
+                    break
+                copied += n
+        except (AttributeError, OSError):
+            if copied:
+                raise
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFFER)
+            copied = fdst.tell()
+    shutil.copystat(src, dest)
+    return copied
+
+
+class TransferStats:
+    """Count the files and bytes moved by concurrent transfers."""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def run(self, transfer, src, dest):
+        n = transfer(src, dest)
+        with self.lock:
+            self.files += 1
+            self.bytes += n
+        return n
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return ("{} files, {:.1f} MiB in {:.2f}s ({:.1f} MiB/s)"
+                .format(self.files, self.bytes / 2**20, elapsed,
+                        self.bytes / 2**20 / elapsed))
+
+
+INSTALL_MANIFEST_VERSION = 1
+
+
+def install_manifest_path(hw_dir):
+    """Return the path of the manifest of files installed in hw_dir.
+
+    Manifests are kept in the git directory of the working tree holding hw_dir,
+    out of the way of the student's commits; outside a repository, return None.
+    """
+    top, name = os.path.split(os.path.abspath(hw_dir))
+    dirs = find_git_dirs(top)
+    if dirs is None:
+        return None
+    return os.path.join(dirs[0], "new-homework", "installed", name + ".json")
+
+
+def read_install_manifest(path):
+    """Return the files recorded in the install manifest at path, or {} if none."""
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+    except (TypeError, OSError, ValueError):
+        return {}
+    if manifest.get('version') != INSTALL_MANIFEST_VERSION:
+        return {}
+    return manifest['files']
+
+
+def problem_files(name, problem_bank):
+    """List the files of assignment name in the problem bank.
+
+    Return a list of (source, path relative to the homework directory), where
+    the source is a PackMember if the bank has a current pack and the path of
+    the file in the bank otherwise.
+    """
+    entry = problem_entry(name, problem_bank) or {}
+    pdf = "{}.pdf".format(name)
+    pack = bank_pack(problem_bank)
+    if pack is not None:
+        files = [(pack.member("All/" + pdf), pdf)] if entry.get('pdf') else []
+        for d in entry.get('dirs', []):
+            top = "{}/{}/".format(d, name)
+            files.extend((m, os.path.join(d, *m.path[len(top):].split('/')))
+                         for m in pack.members(top))
+        return files
+
+    files = []
+    if entry.get('pdf'):
+        files.append((os.path.join(problem_bank, "All", pdf), pdf))
+    for d in entry.get('dirs', []):
+        top = os.path.join(problem_bank, d, name)
+        for dirpath, _, filenames in os.walk(top):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                files.append((path, os.path.join(d, os.path.relpath(path, top))))
+    return files
+
+
+def installed_state(dest, record):
+    """Compare the file dest with its manifest record.
+
+    Return None if dest is missing, True if it is as installed, and False if
+    it has been changed since. The mtime and size are trusted when they match;
+    otherwise (as after a checkout) the contents are hashed.
+    """
+    try:
+        st = os.stat(dest)
+    except FileNotFoundError:
+        return None
+    if record is None:
+        return False
+    if st.st_size == record['size'] and st.st_mtime_ns == record['mtime']:
+        return True
+    return st.st_size == record['size'] and file_sha256(dest) == record['sha256']
+
+
+def install_action(src, dest, record):
+    """Decide how to bring dest up to date with problem bank file src.
+
+    record is dest's entry in the install manifest, or None. Return one of
+    'new' (install it), 'restored' (install again what was deleted), 'updated'
+    (replace an unchanged copy of an older version), 'unchanged', or 'kept'
+    (leave a copy that was changed locally, or not installed by us, as it is).
+    """
+    state = installed_state(dest, record)
+    if state is None:
+        return 'new' if record is None else 'restored'
+    digest = source_sha256(src)
+    if record is None:
+        # Installed before we kept manifests, or made by the student
+        return 'unchanged' if file_sha256(dest) == digest else 'kept'
+    if digest == record['sha256']:
+        return 'unchanged'
+    return 'updated' if state else 'kept'
+
+
+def install_file(stats, transfer, src, dest):
+    """Transfer src to dest, replacing any file there, and return src's SHA-256.
+
+    The old file is removed first rather than written over, as it may be a
+    hard link into the object store.
+    """
+    try:
+        os.unlink(dest)
+    except FileNotFoundError:
+        pass
+    stats.run(transfer, src, dest)
+    return source_sha256(src)
+
+
+@traced
+def install_problem(name, hw_dir, problem_bank, mode='copy', jobs=DEFAULT_JOBS):
+    """Move assignment description and related files into our repository.
+
+    If problem_bank is empty, the directory is missing; note in log.
+
+    With mode 'copy', files are copied from the problem bank. With mode 'link',
+    they are added to the local object store and placed in the repository by
+    reflink where the filesystem supports it and by hard link otherwise, so
+    that repositories installing the same files share their storage. Linked
+    files are read-only. Either way, the files are transferred by a pool of
+    jobs threads.
+
+    The files installed are recorded, with their sizes, mtimes, and hashes, in
+    a manifest kept in the repository's git directory. Installing again (as
+    with --warn-if-exists after a problem bank update) transfers only the files
+    that are new or changed in the bank, leaves alone files the student has
+    changed, and reports what it did. Files that have left the bank are left
+    in place but no longer tracked.
+
+    Return list of installed files and directories (not recursively)
+    relative to repository root directory.
+
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not problem_bank:
+        print("Warning: Missing problem bank, skipping file install.")
+        print("To install later, run with --warn-if-exists and, if appropriate, ")
+        print("use the --problems option to specify location of the problem bank.")
+        return []
+
+    files = problem_files(name, problem_bank)
+    manifest_path = install_manifest_path(hw_dir)
+    recorded = read_install_manifest(manifest_path)
+    transfer = link_file if mode == 'link' else copy_file
+    stats = TransferStats()
+    counts = Counter()
+    manifest = {}
+    failed = set()
+
+    if not any(rel == name + ".pdf" for _, rel in files):
+        print("Warning: Could not install PDF file from problem bank: no file {}.pdf."
+              .format(name), file=sys.stderr)
+
+    def warn(src, dest, why):
+        failed.add(os.path.relpath(dest, hw_dir))
+        print("Warning: could not copy {s} to {d} ({why})"
+              .format(s=src, d=dest, why=why), file=sys.stderr)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        deciding = [(src, rel, pool.submit(install_action, src, os.path.join(hw_dir, rel),
+                                           recorded.get(rel)))
+                    for src, rel in files]
+        queued = []
+        for src, rel, decided in deciding:
+            dest = os.path.join(hw_dir, rel)
+            try:
+                action = decided.result()
+                if action == 'unchanged' and rel not in recorded:
+                    st = os.stat(dest)  # adopt a copy installed before manifests
+                    recorded[rel] = {'size': st.st_size, 'mtime': st.st_mtime_ns,
+                                     'sha256': source_sha256(src)}
+            except OSError as why:
+                warn(src, dest, why)
+                continue
+            counts[action] += 1
+            if action in ('unchanged', 'kept'):
+                if action == 'kept':
+                    log("Keeping {} as it has changed locally".format(rel))
+                if rel in recorded:
+                    manifest[rel] = recorded[rel]
+                continue
+            if action != 'new':
+                log("{} {}".format(action.capitalize(), rel))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            queued.append((src, dest, rel, pool.submit(install_file, stats, transfer, src, dest)))
+
+        for src, dest, rel, transferred in queued:
+            try:
+                digest = transferred.result()
+                st = os.stat(dest)
+            except OSError as why:
+                warn(src, dest, why)
+                continue
+            manifest[rel] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha256': digest}
+
+    in_bank = set(rel for _, rel in files)
+    for rel in recorded:
+        if rel not in in_bank and os.path.exists(os.path.join(hw_dir, rel)):
+            counts['dropped'] += 1
+            log("Leaving {}, which is no longer in the problem bank".format(rel))
+
+    if manifest_path is not None:
+        try:
+            os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+            write_json_atomically(manifest_path, {'version': INSTALL_MANIFEST_VERSION,
+                                                  'bank': problem_bank,
+                                                  'files': manifest})
+        except OSError as e:
+            log("Could not save install manifest: {}".format(e))
+
+    log("Transferred {} with {} threads".format(stats.summary(), jobs))
+    count(files=stats.files, bytes=stats.bytes)
+    if counts['updated'] or counts['unchanged'] or counts['kept'] or counts['dropped']:
+        print("Reinstalled {}: {} new, {} updated, {} restored, {} unchanged, "
+              "{} kept with local changes, {} no longer in the bank."
+              .format(name, counts['new'], counts['updated'], counts['restored'],
+                      counts['unchanged'], counts['kept'], counts['dropped']),
+              file=sys.stderr)
+    save_object_hashes()
+
+    top = set(rel.split(os.sep)[0] for rel in in_bank)
+    broken = set(rel.split(os.sep)[0] for rel in failed)
+    return sorted(os.path.join(name, t) for t in top - broken)
+
+
+def safe_assignment_name(name):
+    """Convert an assignment name into one safe to use as a filename.
+
+    This is used for template files, e.g. unit testing and source files. The
+    primary concern is that assignment names contain hyphens, but filenames with
+    hyphens cannot be imported in Python.
+    """
+
+    return name.replace("-", "_").strip()
+
+
+TEMPLATE_CACHE_VERSION = 1
+PLACEHOLDER = b"ASSIGN"
+
+_template_sets = {}
+
+
+def find_placeholders(path):
+    """Return the offsets of each PLACEHOLDER in the file at path.
+
+    The file is read in chunks, keeping enough of each chunk to find a
+    placeholder that straddles two of them.
+    """
+    offsets = []
+    keep = len(PLACEHOLDER) - 1
+    tail, base = b"", 0    # tail holds the last bytes read, from offset base
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER), b""):
+            buf = tail + chunk
+            i = buf.find(PLACEHOLDER)
+            while i >= 0:
+                offsets.append(base + i)
+                i = buf.find(PLACEHOLDER, i + len(PLACEHOLDER))
+            # Keep what could begin a placeholder, but not part of one just found
+            cut = max(0, len(buf) - keep)
+            if offsets and offsets[-1] >= base:
+                cut = max(cut, offsets[-1] + len(PLACEHOLDER) - base)
+            tail, base = buf[cut:], base + cut
+    return offsets
+
+
+def compile_templates(template_dir):
+    """Scan the template files in template_dir for their placeholders.
+
+    Return the compiled set: the mtimes of template_dir and its subdirectories,
+    and for each file its path, mtime, size, and placeholder offsets.
+    """
+    dirs, files = {}, []
+    for dirpath, _, filenames in os.walk(template_dir):
+        dirs[os.path.relpath(dirpath, template_dir)] = mtime_stamp(dirpath)
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            st = os.stat(path)
+            files.append({'path': os.path.relpath(path, template_dir),
+                          'mtime': st.st_mtime_ns,
+                          'size': st.st_size,
+                          'offsets': find_placeholders(path)})
+    return {'version': TEMPLATE_CACHE_VERSION, 'dir': template_dir,
+            'dirs': dirs, 'files': files}
+
+
+def templates_current(templates):
+    """Check a compiled template set against its files, without listing directories.
+
+    Adding or removing a file changes the mtime of its directory, and editing
+    one changes its own mtime or size.
+    """
+    top = templates['dir']
+    if any(mtime_stamp(os.path.join(top, d)) != mtime for d, mtime in templates['dirs'].items()):
+        return False
+    for t in templates['files']:
+        try:
+            st = os.stat(os.path.join(top, t['path']))
+        except OSError:
+            return False
+        if st.st_mtime_ns != t['mtime'] or st.st_size != t['size']:
+            return False
+    return True
+
+
+def template_set(template_dir):
+    """Return the compiled templates in template_dir, compiling them only if stale.
+
+    Compiled sets are kept in memory and in our cache directory, keyed by
+    template directory and validated against the mtimes of its files.
+    """
+    templates = _template_sets.get(template_dir)
+    if templates is not None and templates_current(templates):
+        return templates
+
+    key = hashlib.sha1(template_dir.encode()).hexdigest()[:16]
+    path = os.path.join(cache_dir("templates"), key + ".json")
+    try:
+        with open(path, "r") as f:
+            templates = json.load(f)
+    except (OSError, ValueError):
+        templates = None
+
+    if templates is None or templates.get('version') != TEMPLATE_CACHE_VERSION or \
+       templates.get('dir') != template_dir or not templates_current(templates):
+        templates = compile_templates(template_dir)
+        log("Compiled {} templates in {}".format(len(templates['files']), template_dir))
+        try:
+            write_json_atomically(path, templates)
+        except OSError as e:
+            log("Could not save compiled templates: {}".format(e))
+
+    _template_sets[template_dir] = templates
+    return templates
+
+
+def find_template(language, hdir_name, problem_bank):
+    """Find the template files to install for an assignment.
+
+    The template contains a source file and a unit test file, with correct names
+    so the student can easily run tests and so CI knows how to find the tests.
+
+    We first look in the assignment directory in the problem bank for a template
+    specific to this assignment; if no templates exist, we look in the problem
+    bank's `.skel` directory.
+
+    Return a list of (source, placeholder offsets, installed file name)
+    triples, which is empty for language 'none'. The source is a path or, if
+    the bank has a current pack, a PackMember.
+    """
+
+    if language == "none":
+        return []
+
+    index = problem_index(problem_bank)
+    entry = problem_entry(hdir_name, problem_bank) or {}
+    lang = language.lower()
+    template_dirs = [
+        (os.path.join(problem_bank, "Skel", hdir_name, lang),
+         lang in entry.get('languages', [])),
+        (os.path.join(problem_bank, ".skel", lang),
+         lang in index['languages'])
+    ]
+
+    safename = safe_assignment_name(hdir_name)
+
+    for template_dir, available in template_dirs:
+        if not available:
+            continue
+
+        top = os.path.relpath(template_dir, problem_bank).replace(os.sep, '/')
+        pack = bank_pack(problem_bank)
+        if pack is not None:
+            # Packs hold their templates' placeholder offsets
+            return [(m, m.offsets, m.path.rpartition('/')[2].replace("ASSIGN", safename))
+                    for m in pack.members(top)]
+        return [(os.path.join(template_dir, t['path']), t['offsets'],
+                 os.path.basename(t['path']).replace("ASSIGN", safename))
+                for t in template_set(os.path.abspath(template_dir))['files']]
+
+    die("No template exists for --language={}".format(language), error=ProblemBankError)
+
+
+def render_template(src, offsets, safename):
+    """Yield the contents of template file src for assignment safename in chunks.
+
+    The text between the placeholders at offsets is streamed from src as is, so
+    binary and large templates are rendered without reading them whole.
+    """
+    name = safename.encode()
+    with (src.open() if isinstance(src, PackMember) else open(src, "rb")) as f:
+        pos = 0
+        for offset in offsets + [None]:
+            remaining = None if offset is None else offset - pos
+            while remaining is None or remaining > 0:
+                chunk = f.read(COPY_BUFFER if remaining is None else min(COPY_BUFFER, remaining))
+                if not chunk:
+                    break
+                yield chunk
+                if remaining is not None:
+                    remaining -= len(chunk)
+            if offset is not None:
+                yield name
+                pos = offset + len(PLACEHOLDER)
+                f.read(len(PLACEHOLDER))
+
+
+@traced
+def install_template(language, hdir_name, problem_bank, hw_dir):
+    """Install a template into the repository's homework directory hw_dir."""
+    safename = safe_assignment_name(hdir_name)
+    for src, offsets, filename in find_template(language, hdir_name, problem_bank):
+        with open(os.path.join(hw_dir, filename), "wb") as f:
+            f.writelines(render_template(src, offsets, safename))
+            count(files=1, bytes=f.tell())
+
+
+def get_problem_info(name, problem_bank):
+    """Check if the problem exists in the bank.
+
+    Dies if the problem does not exist. Return a tuple:
+    (is-vignette?, num-parts)
+    where non-vignettes have only 1 part.
+    """
+
+    entry = problem_entry(name, problem_bank)
+    count = entry['parts'] if entry else 0
+
+    if count == 0:
+        die("Cannot find an assignment named '{}' in the problem bank.".format(name),
+            "The name must be spelled exactly as in the problem-bank repo.",
+            "Or the assignment is new and you did not pull the latest problem-bank updates.",
+            error=UnknownAssignmentError, assignment=name)
+
+    return count > 1, count
+
+# Dirty check
+
+def fsmonitor_config(repo):
+    """Return git -c options enabling the built-in fsmonitor, if it is usable.
+
+    The built-in fsmonitor daemon is available on macOS and Windows from git
+    2.36. If the repository already configures an fsmonitor (a hook, say),
+    git uses it anyway and nothing needs to be added.
+    """
+    try:
+        if repo.config_reader().get_value('core', 'fsmonitor', ''):
+            return []
+    except Exception:
+        pass
+    if sys.platform in ('darwin', 'win32') and repo.git.version_info >= (2, 36):
+        return ['-c', 'core.fsmonitor=true']
+    return []
+
+
+@traced
+def is_dirty(repo):
+    """Return whether repo has uncommitted changes to tracked files.
+
+    Repo.is_dirty() runs git diff, which compares the stat information cached
+    in the index with the files on disk but never saves what it learns, so any
+    file whose stat information is stale (after a copy, or when a network
+    filesystem reports new ctimes) is reread and rehashed on every run. git
+    status refreshes that stat cache and writes it back, so each such file is
+    hashed once, and later checks of an unchanged repository only stat its
+    files. When an fsmonitor is available, git status asks it which files
+    changed and does not even stat the rest.
+    """
+    return bool(run_git(repo, *fsmonitor_config(repo), 'status', '--porcelain',
+                        '--untracked-files=no', '--no-renames'))
+
+
+# Staging
+
+HASH_CHUNK = 1 << 20    # bytes read at a time when hashing or compressing a file
+
+
+class ChunkReader(io.RawIOBase):
+    """A binary file object reading from an iterable of byte strings."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.pending:
+            self.pending = next(self.chunks, None)
+            if self.pending is None:
+                self.pending = b""
+                return 0
+        n = min(len(b), len(self.pending))
+        b[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+
+def blob_source(src):
+    """Return (mode, size, reader) for a blob source.
+
+    A source is a file path, a PackMember, bytes, or a tuple (template source,
+    placeholder offsets, safename) to be rendered by render_template. reader() returns a
+    binary file object for the blob's contents.
+    """
+    if isinstance(src, PackMember):
+        return ('100755' if src.mode & 0o100 else '100644'), src.size, src.open
+    if isinstance(src, tuple):
+        path, offsets, safename = src
+        size = (path.size if isinstance(path, PackMember) else os.stat(path).st_size) + \
+            len(offsets) * (len(safename.encode()) - len(PLACEHOLDER))
+        return '100644', size, \
+            lambda: io.BufferedReader(ChunkReader(render_template(*src)), COPY_BUFFER)
+    if not isinstance(src, str):
+        return '100644', len(src), lambda: io.BytesIO(src)
+    st = os.lstat(src)
+    if stat.S_ISLNK(st.st_mode):
+        target = os.fsencode(os.readlink(src))
+        return '120000', len(target), lambda: io.BytesIO(target)
+    mode = '100755' if st.st_mode & 0o100 else '100644'
+    return mode, st.st_size, lambda: open(src, "rb")
+
+
+def hash_blob(src):
+    """Return (mode, blob id) of a blob source, reading it in chunks."""
+    mode, size, reader = blob_source(src)
+    h = hashlib.sha1(b"blob %d\0" % size)
+    with reader() as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return mode, h.hexdigest()
+
+
+def write_loose_object(objects_dir, sha, src):
+    """Write a blob source into objects_dir as the loose object sha."""
+    path = os.path.join(objects_dir, sha[:2], sha[2:])
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _, size, reader = blob_source(src)
+    tmp = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    z = zlib.compressobj(1)  # git's default core.looseCompression
+    with reader() as f, open(tmp, "wb") as out:
+        out.write(z.compress(b"blob %d\0" % size))
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            out.write(z.compress(chunk))
+        out.write(z.flush())
+    os.chmod(tmp, 0o444)
+    os.replace(tmp, path)
+
+
+def missing_objects(repo, shas):
+    """Return the set of shas that are not in repo's object database."""
+    if not shas:
+        return set()
+    out = run_git(repo, 'cat-file', '--batch-check=%(objectname)',
+                  input="".join(sha + "\n" for sha in shas).encode())
+    return {line.split()[0] for line in out.splitlines() if line.endswith(' missing')}
+
+
+@traced
+def store_blobs(repo, sources, jobs=DEFAULT_JOBS):
+    """Add blob sources (file paths or bytes) to repo's object database.
+
+    Sources are hashed on a thread pool, reading files in chunks; hashlib and
+    zlib release the GIL on large buffers, so the threads run in parallel.
+    Only the blobs the repository does not already have are compressed and
+    written, as loose objects. Return a list of (mode, blob id) for sources.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        blobs = list(pool.map(hash_blob, sources))
+        missing = missing_objects(repo, sorted({sha for _, sha in blobs}))
+        objects_dir = os.path.join(repo.common_dir, 'objects')
+        todo = {sha: src for src, (_, sha) in zip(sources, blobs) if sha in missing}
+        for done in [pool.submit(write_loose_object, objects_dir, sha, src)
+                     for sha, src in todo.items()]:
+            done.result()
+    log("Stored {} blobs: {} objects written, {} reused"
+        .format(len(blobs), len(todo), len(blobs) - len(todo)))
+    count(files=len(todo))
+    return blobs
+
+
+# Committing without a checkout
+
+EMPTY_OID = '0' * 40
+
+
+def run_git(repo, *args, input=None, env=None):
+    """Run a git command in repo (a Repo or a directory) and return its output, stripped.
+
+    Unlike repo.git, this takes input as bytes for the command's standard input
+    and extra environment variables in env. Calls die() if git fails.
+    """
+    import subprocess
+
+    full_env = dict(os.environ, **env) if env else None
+    cwd = repo if isinstance(repo, str) else repo.working_tree_dir
+    count(git=1)
+    proc = subprocess.run(['git', '-C', cwd] + list(args),
+                          input=input, env=full_env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        stderr = proc.stderr.decode(errors='replace').strip()
+        command = next(a for a in args if not a.startswith('-') and '=' not in a)
+        die("git {} failed: {}".format(command, stderr),
+            error=GitCommandError, command=['git'] + list(args), stderr=stderr)
+    return proc.stdout.decode().strip()
+
+
+@traced
+def assignment_files(language, hdir_name, problem_bank, opts):
+    """List the files making up the initial commit of an assignment.
+
+    Return a list of (path relative to the homework directory, source) pairs,
+    where source is the path of a file in the problem bank or a PackMember,
+    the bytes of a generated file, or a template to render (see blob_source).
+    """
+    files = [('.gitkeep', b"\n")]
+    if opts.no_install:
+        return files
+
+    files.extend((rel, src) for src, rel in problem_files(hdir_name, problem_bank))
+
+    safename = safe_assignment_name(hdir_name)
+    for src, offsets, filename in find_template(language, hdir_name, problem_bank):
+        files.append((filename, (src, offsets, safename)))
+    return files
+
+
+def write_blobs(repo, files, jobs=DEFAULT_JOBS):
+    """Write the sources of files into repo's object database.
+
+    Return a list of (mode, blob id, path) for each of files.
+    """
+    return [(mode, sha, rel) for (rel, _), (mode, sha)
+            in zip(files, store_blobs(repo, [src for _, src in files], jobs))]
+
+
+@traced
+def commit_without_checkout(repo, hw_branch, base, hdir_name, entries):
+    """Commit entries under hdir_name on top of base as branch hw_branch.
+
+    base is a commit id, as tags and other names must be peeled first. The tree is built in a temporary index, so neither the working tree nor
+    the repository's index is touched, and the branch is created (or, if it
+    already exists, advanced) by a single compare-and-swap ref update.
+    Return the id of the new commit.
+    """
+    ref = 'refs/heads/' + hw_branch
+    old = EMPTY_OID
+    if hw_branch_exists(repo, hw_branch):
+        old = base = run_git(repo, 'rev-parse', ref)
+
+    tmp_index = os.path.join(repo.git_dir, 'new-homework-index.{}'.format(os.getpid()))
+    env = {'GIT_INDEX_FILE': tmp_index}
+    try:
+        run_git(repo, 'read-tree', base, env=env)
+        index_info = "".join("{} {}\t{}\n".format(mode, sha, hdir_name + '/' + rel.replace(os.sep, '/'))
+                             for mode, sha, rel in entries)
+        run_git(repo, 'update-index', '--add', '--index-info',
+                input=index_info.encode(), env=env)
+        tree = run_git(repo, 'write-tree', env=env)
+    finally:
+        if os.path.exists(tmp_index):
+            os.unlink(tmp_index)
+
+    commit = run_git(repo, 'commit-tree', tree, '-p', base, '-m', hw_branch)
+    run_git(repo, 'update-ref', '-m', 'new-homework: ' + hw_branch, ref, commit, old)
+    forget_refs(repo)
+    return commit
+
+
+def provision_without_checkout(repo, language, aname, opts, problem_bank, plan=None):
+    """Like provision, but write the assignment's commit directly into the
+    object database from the problem bank, never touching the working tree.
+
+    The new branch is checked out only if opts.checkout is set. plan is the
+    result of plan_assignment, if the caller has already computed it.
+    """
+    hw_branch, base, hdir_name, sequelp, is_vignette = \
+        plan or plan_assignment(repo, aname, opts, problem_bank)
+    hw_dir = os.path.join(repo.working_tree_dir, hdir_name)
+
+    if not has_ref(repo, base):
+        die("Base branch {} does not exist".format(base), error=RepositoryError)
+    try:
+        base_commit = run_git(repo, 'rev-parse', '--verify', base + '^{commit}')
+    except GitCommandError:
+        die("Base {} is not a commit".format(base), error=RepositoryError)
+
+    if sequelp:
+        if not hw_branch_exists(repo, hw_branch):
+            run_git(repo, 'update-ref', '-m', 'new-homework: ' + hw_branch,
+                    'refs/heads/' + hw_branch, base_commit, EMPTY_OID)
+            forget_refs(repo)
+        log("Sequel branch {} created off branch {}.".format(hw_branch, base))
+    elif opts.no_commit:
+        if not hw_branch_exists(repo, hw_branch):
+            run_git(repo, 'branch', hw_branch, base)
+            forget_refs(repo)
+    else:
+        entries = write_blobs(repo, assignment_files(language, hdir_name,
+                                                     problem_bank, opts), opts.jobs)
+        commit = commit_without_checkout(repo, hw_branch, base_commit, hdir_name, entries)
+        log("Committed {} files for {} as {} on branch {}."
+            .format(len(entries), hdir_name, commit[:10], hw_branch))
+
+    if opts.checkout and not opts.worktree:
+        repo.git.checkout(hw_branch)
+    return hw_branch, hw_dir, is_vignette
+
+
+# Per-assignment worktrees
+
+def worktree_path(repo, hw_branch, requested):
+    """Return the path for the worktree of hw_branch.
+
+    Unless a path was requested, the worktree is a sibling of the repository
+    named after it and the branch, like assignments-me-cow-proximity.
+    """
+    if requested:
+        return os.path.abspath(os.path.expanduser(requested))
+    root = repo.working_tree_dir.rstrip(os.sep)
+    return "{}-{}".format(root, hw_branch)
+
+
+@traced
+def add_sparse_worktree(repo, path, hw_branch, base, hdir_name):
+    """Check out hw_branch in a new worktree at path, limited to hdir_name.
+
+    The branch is created from base if it does not exist yet. The worktree's
+    sparse checkout (in cone mode) contains only the files at the top of the
+    repository and the directory hdir_name, so its size does not grow with the
+    number of earlier assignments. Return a Repo for the worktree.
+    """
+    if os.path.exists(path):
+        die("Cannot create a worktree at {}: it already exists.".format(path))
+
+    if hw_branch_exists(repo, hw_branch):
+        run_git(repo, 'worktree', 'add', '--no-checkout', path, hw_branch)
+    else:
+        run_git(repo, 'worktree', 'add', '--no-checkout', '-b', hw_branch, path, base)
+        forget_refs(repo)
+    log("Created worktree {} for branch {}".format(path, hw_branch))
+
+    worktree = import_git().Repo(path)
+    run_git(worktree, 'sparse-checkout', 'set', '--cone', hdir_name)
+    run_git(worktree, 'read-tree', '-mu', 'HEAD')
+    return worktree
+
+
+def provision_in_worktree(repo, language, aname, opts, problem_bank):
+    """Like provision, but set up the assignment in a sparse worktree of its own.
+
+    The repository's own working tree is left alone, so assignments can be
+    provisioned into separate worktrees concurrently.
+    """
+    hw_branch, base, hdir_name, sequelp, is_vignette = \
+        plan_assignment(repo, aname, opts, problem_bank)
+
+    if not has_ref(repo, base):
+        die("Base branch {} does not exist".format(base), error=RepositoryError)
+
+    if opts.plumbing:
+        provision_without_checkout(repo, language, aname, opts, problem_bank,
+                                   (hw_branch, base, hdir_name, sequelp, is_vignette))
+        worktree = add_sparse_worktree(repo, worktree_path(repo, hw_branch, opts.worktree_dir),
+                                       hw_branch, base, hdir_name)
+        return hw_branch, os.path.join(worktree.working_tree_dir, hdir_name), is_vignette
+
+    worktree = add_sparse_worktree(repo, worktree_path(repo, hw_branch, opts.worktree_dir),
+                                   hw_branch, base, hdir_name)
+    hw_dir = os.path.join(worktree.working_tree_dir, hdir_name)
+
+    if not sequelp:
+        install_assignment(language, hdir_name, hw_dir, problem_bank, opts)
+
+        if not opts.no_commit:
+            commit_assignment(worktree, hdir_name, hw_branch, opts.jobs)
+    return hw_branch, hw_dir, is_vignette
+
+
+# Provisioning
+
+@traced
+def plan_assignment(repo, aname, opts, problem_bank):
+    """Check that assignment aname can be started in repo and name its branch.
+
+    Return tuple (branch_name, base_name, doc_name, auto-sequel-branch?,
+    is_vignette).
+    """
+    is_vignette, num_parts = get_problem_info(aname, problem_bank)
+    touches_tree = not (opts.plumbing or opts.worktree) or \
+        (opts.checkout and not opts.worktree)
+
+    if touches_tree and is_dirty(repo):
+        die("Your repository has uncommitted changes.",
+            "You must commit or stash all changes before creating a new branch.",
+            error=DirtyRepositoryError)
+
+    hw_branch, base, hdir_name, sequelp = \
+        branch_base_dir_names(repo, aname, opts.base or "master", is_vignette,
+                              num_parts, opts.suffix)
+
+    branch_exists = hw_branch_exists(repo, hw_branch)
+    if branch_exists:
+        if opts.warn_if_exists:
+            print("Branch {} already exists, continuing anyway."
+                  .format(hw_branch), file=sys.stderr)
+        elif not touches_tree:
+            die("You already have a branch named {}.".format(hw_branch),
+                "To continue, re-run with --warn-if-exists.",
+                error=BranchExistsError, branch=hw_branch)
+        else:
+            branch_exists.checkout()
+            die("You already have a branch named {}.".format(hw_branch),
+                "Checking out branch and exiting with no other action taken.",
+                "To continue, re-run with --warn-if-exists; "
+                "see options --no-install and --no-commit.",
+                error=BranchExistsError, branch=hw_branch)
+
+    return hw_branch, base, hdir_name, sequelp, is_vignette
+
+
+@traced
+def install_assignment(language, hdir_name, hw_dir, problem_bank, opts):
+    """Create the homework directory and install the assignment's files."""
+    make_hw_directory(hw_dir, hdir_name)
+
+    if not opts.no_install:
+        files = install_problem(hdir_name, hw_dir, problem_bank,
+                                opts.install_mode, opts.jobs)
+        log('Installed files: {}'.format(", ".join(files)))
+
+        install_template(language, hdir_name, problem_bank, hw_dir)
+
+
+@traced
+def commit_assignment(repo, hdir_name, hw_branch, jobs=DEFAULT_JOBS):
+    """Add a clean initial commit on the branch with the installed files.
+
+    The files are hashed and written to the object database in parallel by
+    store_blobs and then added to the index in one update-index call.
+    """
+    hw_dir = os.path.join(repo.working_tree_dir, hdir_name)
+    paths = [os.path.join(dirpath, filename)
+             for dirpath, _, filenames in os.walk(hw_dir)
+             for filename in filenames]
+    try:
+        blobs = store_blobs(repo, paths, jobs)
+    except OSError as err:
+        die("Cannot stage installed files in repository", err)
+    index_info = "".join(
+        "{} {}\t{}\n".format(mode, sha, os.path.relpath(path, repo.working_tree_dir)
+                              .replace(os.sep, '/'))
+        for path, (mode, sha) in zip(paths, blobs))
+    run_git(repo, 'update-index', '--add', '--index-info', input=index_info.encode())
+    repo.index.commit("{}".format(hw_branch))
+    log("Committing initial state of work on branch {}.".format(hw_branch))
+
+
+def provision_in_place(repo, language, aname, opts, problem_bank):
+    """Create and check out the assignment branch in repo's working tree,
+    install the assignment's files there, and commit them.
+    """
+    hw_branch, base, hdir_name, sequelp, is_vignette = \
+        plan_assignment(repo, aname, opts, problem_bank)
+    hw_dir = os.path.join(repo.working_tree_dir, hdir_name)
+
+    # Create the branch, install relevant files, and make initial commit
+    make_hw_branch(repo, hw_branch, base)
+
+    if not sequelp:
+        install_assignment(language, hdir_name, hw_dir, problem_bank, opts)
+
+        if not opts.no_commit:
+            commit_assignment(repo, hdir_name, hw_branch, opts.jobs)
+    else:
+        log("Sequel branch {} created off branch {}.".format(hw_branch, base))
+        log("No commit made on sequel branch {}.".format(hw_branch))
+
+    return hw_branch, hw_dir, is_vignette
+
+
+@traced
+def create_remaining_parts(repo, hw_branch, num_parts):
+    """Create the branches for the parts of a vignette after hw_branch.
+
+    hw_branch is root-n; the branches root-(n+1) through root-num_parts are
+    created pointing at its commit in a single atomic ref transaction, with no
+    checkouts. Return the list of branches created.
+    """
+    root, _, n = hw_branch.rpartition('-')
+    names = ["{}-{}".format(root, k) for k in range(int(n) + 1, num_parts + 1)]
+    if not names:
+        return names
+
+    sha = run_git(repo, 'rev-parse', 'refs/heads/' + hw_branch)
+    run_git(repo, 'update-ref', '-m', 'new-homework: ' + root, '--stdin',
+            input="".join("create refs/heads/{} {}\n".format(name, sha)
+                          for name in names).encode())
+    forget_refs(repo)
+    log("Created remaining vignette branches {}.".format(", ".join(names)))
+    return names
+
+
+PROVISION_DEFAULTS = {
+    'base': None,
+    'suffix': None,
+    'warn_if_exists': False,
+    'no_install': False,
+    'no_commit': False,
+    'install_mode': 'copy',
+    'jobs': DEFAULT_JOBS,
+    'plumbing': False,
+    'checkout': False,
+    'worktree': False,
+    'worktree_dir': None,
+    'all_parts': False,
+}
+
+
+def provision_options(**options):
+    """Return options for provision, as the command line would give them.
+
+    Each keyword names a command-line option (e.g., plumbing=True for
+    --plumbing); the rest take their defaults from PROVISION_DEFAULTS.
+    """
+    unknown = set(options) - set(PROVISION_DEFAULTS)
+    if unknown:
+        raise TypeError("Unknown provisioning options: {}".format(", ".join(sorted(unknown))))
+    return SimpleNamespace(**dict(PROVISION_DEFAULTS, **options))
+
+
+@traced
+def provision(repo, language, aname, opts, problem_bank):
+    """Create the branch for assignment aname in repo and install its files.
+
+    repo is an open Repo, which may be reused across calls. opts carries the
+    command-line options (base, suffix, warn_if_exists, no_install, no_commit,
+    install_mode, jobs, plumbing, checkout, worktree, worktree_dir, and
+    all_parts); see provision_options. problem_bank is a path or a
+    ProblemBank. Raises a HomeworkError on failure.
+
+    Return tuple (branch_name, hw_dir, is_vignette).
+    """
+    problem_bank = os.fspath(problem_bank)
+    if opts.worktree:
+        result = provision_in_worktree(repo, language, aname, opts, problem_bank)
+    elif opts.plumbing:
+        result = provision_without_checkout(repo, language, aname, opts, problem_bank)
+    else:
+        result = provision_in_place(repo, language, aname, opts, problem_bank)
+
+    hw_branch, _, is_vignette = result
+    if opts.all_parts and is_vignette:
+        _, num_parts = get_problem_info(aname, problem_bank)
+        create_remaining_parts(repo, hw_branch, num_parts)
+    return result
+
+
+def find_git_dirs(work_dir):
+    """Find the git directories of the repository whose top is work_dir.
+
+    Reads .git directly, following a gitdir: file for worktrees. Return a
+    tuple (git dir, common git dir), or None if work_dir is not a repository.
+    """
+    dot_git = os.path.join(work_dir, '.git')
+    if os.path.isdir(dot_git):
+        git_dir = dot_git
+    elif os.path.isfile(dot_git):
+        with open(dot_git, "r") as f:
+            line = f.read().strip()
+        if not line.startswith('gitdir:'):
+            return None
+        git_dir = os.path.normpath(os.path.join(work_dir, line[len('gitdir:'):].strip()))
+    else:
+        return None
+
+    try:
+        with open(os.path.join(git_dir, 'commondir'), "r") as f:
+            return git_dir, os.path.normpath(os.path.join(git_dir, f.read().strip()))
+    except OSError:
+        return git_dir, git_dir
+
+
+@traced
+def quick_check(repo_dir, problems, aname):
+    """Make the checks that need no GitPython, before it is imported.
+
+    Reading .git and the problem bank index directly, check that repo_dir
+    passes strictly_validate, that the problem bank exists, and that it has
+    the assignment aname, dying with the same errors as the full checks. If
+    repo_dir does not look like a repository, leave that to open_repo.
+    """
+    dirs = find_git_dirs(repo_dir)
+    if dirs is None:
+        return
+    if 'clean-start' not in ref_index_at(dirs[1])['names']:
+        die("Repository '{0}' fails strict validity checks ({1}).".format(
+                os.path.abspath(repo_dir), 'repo does not have a ref named clean-start'),
+            "If this is assessment incorrect, consider using --skip-checks.",
+            error=RepositoryError)
+    get_problem_info(aname, check_problem_bank(repo_dir, problems))
+
+
+@traced
+def open_repo(maybe_repo, guess, cwd):
+    """Find the homework repository and check it; calls die() on failure."""
+    repo = find_repo(maybe_repo, guess, cwd)
+    if repo is None:
+        die("Could not find a valid assignments repository.",
+            "Are you running this command from inside your assignments repository?",
+            error=RepositoryError)
+
+    valid, why = strictly_validate(repo)
+    if not valid:
+        die("Repository '{0}' fails strict validity checks ({1}).".format(repo.working_tree_dir, why),
+            "If this is assessment incorrect, consider using --skip-checks.",
+            error=RepositoryError)
+    return repo
+
+
+# Batch provisioning
+
+MANIFEST_FIELDS = ['repo', 'language', 'assignment']
+
+
+def read_manifest(path):
+    """Read a batch manifest, returning a list of dicts with MANIFEST_FIELDS.
+
+    A manifest is either a CSV file with a header row naming at least the
+    columns repo, language, and assignment, or (if its name ends in .jsonl or
+    .json) a file of JSON objects with those keys, one per line. Relative repo
+    paths are taken relative to the manifest's directory.
+    """
+    import csv
+
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, "r") as f:
+        if path.endswith(('.jsonl', '.json')):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    entries = []
+    seen = {}
+    for position, row in enumerate(rows, 1):
+        missing = [k for k in MANIFEST_FIELDS if not row.get(k)]
+        if missing:
+            die("Manifest {} entry {} is missing {}."
+                .format(path, position, ", ".join(missing)))
+        entry = {k: row[k].strip() for k in MANIFEST_FIELDS}
+        entry['repo'] = os.path.normpath(
+            os.path.join(base, os.path.expanduser(entry['repo'])))
+        triple = tuple(entry[k] for k in MANIFEST_FIELDS)
+        entry['occurrence'] = seen[triple] = seen.get(triple, 0) + 1
+        entries.append(entry)
+    return entries
+
+
+def journal_key(entry):
+    """Identify a manifest entry in the journal.
+
+    Successive parts of a vignette are entries with the same repo, language,
+    and assignment, so the key also counts which of those entries this is.
+    Unlike a line number, that survives edits elsewhere in the manifest.
+    """
+    return (entry['repo'], entry['language'], entry['assignment'], entry.get('occurrence'))
+
+
+def read_journal_records(path, offset=0):
+    """Return the records in the journal at path from byte offset on."""
+    records = []
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # a partial line from an interrupted run
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def read_journal(path):
+    """Return the set of journal keys of entries already provisioned."""
+    return {journal_key(r) for r in read_journal_records(path) if r.get('status') == 'ok'}
+
+
+def append_journal(path, records):
+    """Append records to the journal at path and sync it to disk.
+
+    The records are written in one write to a file opened for appending, so
+    the lines written by several worker processes do not interleave.
+    """
+    with open(path, "a") as f:
+        f.write("".join(json.dumps(r) + "\n" for r in records))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def init_batch_worker(indexes, verbosity, profiling=False):
+    """Seed a batch worker process with the parent's problem bank indexes."""
+    global verbose
+    verbose = verbosity
+    _problem_indexes.update(indexes)
+    if profiling:
+        start_profiling()
+
+
+def provision_entries(entries, opts, journal):
+    """Provision manifest entries for one repository in order.
+
+    Each entry's record is appended to the journal as soon as it is done, so
+    that it is not redone if the batch is interrupted. When profiling, the
+    records returned carry the entry's phases under 'phases', for run_batch
+    to collect.
+    """
+    records = []
+    for entry in entries:
+        record = provision_entry(entry, opts)
+        append_journal(journal, [record])
+        if _profile is not None:
+            record['phases'] = _profile.take()
+        records.append(record)
+    return records
+
+
+@traced
+def provision_entry(entry, opts):
+    """Provision one manifest entry, returning a journal record."""
+    record = dict(entry)
+    try:
+        repo = open_repo(entry['repo'], False, entry['repo'])
+        problem_bank = check_problem_bank(repo.working_tree_dir, opts.problems)
+        branch, _, _ = provision(repo, entry['language'], entry['assignment'],
+                                 opts, problem_bank)
+        record.update(status='ok', branch=branch)
+    except HomeworkError as e:
+        record.update(status='failed', error=" ".join(str(m) for m in e.args))
+    except Exception as e:
+        record.update(status='failed', error="{}: {}".format(type(e).__name__, e))
+    return record
+
+
+def run_batch(opts):
+    """Provision every entry of the manifest opts.batch in a process pool.
+
+    Different repositories are provisioned in parallel; the entries for any one
+    repository are provisioned in manifest order by a single worker. Entries
+    recorded as done in the journal are skipped, so an interrupted
+    batch can be resumed by running it again. If a worker process dies, the
+    entries of its repository that it had not journaled are reported as
+    failed. Return the number of failures.
+    """
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    entries = read_manifest(opts.batch)
+    journal = opts.journal or opts.batch + ".journal"
+    done = read_journal(journal)
+    todo = [e for e in entries if journal_key(e) not in done]
+    log("Batch {}: {} entries, {} already done".format(
+        opts.batch, len(entries), len(entries) - len(todo)))
+
+    # Parse each problem bank once, here, and hand the results to the workers
+    indexes = {}
+    for entry in todo:
+        try:
+            bank = check_problem_bank(entry['repo'], opts.problems)
+        except HomeworkError:
+            continue  # reported when the entry itself is provisioned
+        if bank not in indexes:
+            indexes[bank] = problem_index(bank)
+
+    by_repo = {}
+    for entry in todo:
+        by_repo.setdefault(entry['repo'], []).append(entry)
+
+    results = []
+
+    def record(records, journaled=False):
+        for r in records:
+            phases = r.pop('phases', None)
+            if phases:
+                _profile.records.extend(phases)
+        results.extend(records)
+        if not journaled:
+            append_journal(journal, records)
+
+    try:
+        start = os.path.getsize(journal)
+    except OSError:
+        start = 0
+    if opts.fleet:
+        asyncio.run(run_fleet(list(by_repo.values()), opts, record))
+    else:
+        with ProcessPoolExecutor(max_workers=opts.workers,
+                                 initializer=init_batch_worker,
+                                 initargs=(indexes, verbose,
+                                           _profile is not None)) as pool:
+            futures = {pool.submit(provision_entries, group, opts, journal): group
+                       for group in by_repo.values()}
+            for future in as_completed(futures):
+                try:
+                    record(future.result(), journaled=True)
+                except Exception as e:
+                    # The worker died (BrokenProcessPool); keep what it journaled
+                    new = {journal_key(r): r for r in read_journal_records(journal, start)}
+                    group = futures[future]
+                    record([new[journal_key(g)] for g in group if journal_key(g) in new],
+                           journaled=True)
+                    record([dict(g, status='failed', error="Worker process failed: {}: {}"
+                                 .format(type(e).__name__, e))
+                            for g in group if journal_key(g) not in new])
+
+    failures = [r for r in results if r['status'] != 'ok']
+    for r in sorted(results, key=journal_key):
+        if r['status'] == 'ok':
+            print("ok      {repo} {assignment} -> {branch}".format(**r))
+        else:
+            print("FAILED  {repo} {assignment}: {error}".format(**r))
+    print("{} provisioned, {} failed, {} skipped as already done."
+          .format(len(results) - len(failures), len(failures),
+                  len(entries) - len(todo)))
+    if _profile is not None and _profile.records:
+        report_percentiles(_profile.records)
+    return len(failures)
+
+
+# Fleet orchestration
+
+class ByteBudget:
+    """Limit the total bytes of file I/O in flight across coroutines."""
+
+    def __init__(self, limit):
+        import asyncio
+
+        self.limit = limit
+        self.used = 0
+        self.cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def hold(self, nbytes):
+        # An assignment larger than the whole budget runs on its own
+        nbytes = min(nbytes, self.limit)
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.used + nbytes <= self.limit)
+            self.used += nbytes
+        try:
+            yield
+        finally:
+            async with self.cond:
+                self.used -= nbytes
+                self.cond.notify_all()
+
+
+async def run_phase(phase, timeout, holds, func, *args):
+    """Run func(*args) in a worker thread while holding the limits in holds.
+
+    holds are async context managers, like a semaphore of git slots or a hold
+    on the I/O budget. A thread cannot be interrupted, so if func exceeds
+    timeout seconds it is abandoned rather than stopped: PhaseTimeoutError is
+    raised, and the holds are kept until the thread finishes, when the error's
+    pending future completes.
+    """
+    import asyncio
+    from contextlib import AsyncExitStack
+
+    stack = AsyncExitStack()
+    for hold in holds:
+        await stack.enter_async_context(hold)
+    thread = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    try:
+        return await asyncio.wait_for(asyncio.shield(thread), timeout)
+    except asyncio.TimeoutError:
+        async def release():
+            try:
+                await thread
+            except Exception:
+                pass  # the phase was already reported as failed
+            finally:
+                await stack.aclose()
+        die("Timed out after {}s in phase {}.".format(timeout, phase),
+            error=PhaseTimeoutError, pending=asyncio.ensure_future(release()))
+    finally:
+        if thread.done():
+            await stack.aclose()
+
+
+async def fleet_entry(entry, opts, git_slots, io_budget):
+    """Provision one manifest entry phase by phase, returning a journal record."""
+    start = time.perf_counter()
+    try:
+        return await fleet_phases(entry, opts, git_slots, io_budget)
+    finally:
+        if _profile is not None:
+            # Phases run on several threads, so the entry is timed as a whole here
+            _profile.record('fleet_entry', start, time.perf_counter() - start)
+
+
+async def fleet_phases(entry, opts, git_slots, io_budget):
+    """Run the phases of fleet_entry."""
+    record = dict(entry)
+    timeout = opts.phase_timeout
+    aname = entry['assignment']
+    try:
+        repo = await run_phase('find_repo', timeout, [git_slots], open_repo,
+                               entry['repo'], False, entry['repo'])
+        problem_bank = await run_phase('check_problem_bank', timeout, [],
+                                       check_problem_bank, repo.working_tree_dir,
+                                       opts.problems)
+        if opts.plumbing or opts.worktree:
+            # These modes do not share the phases of a checkout in place
+            nbytes = (problem_entry(aname, problem_bank) or {}).get('bytes', 0)
+            hw_branch, _, _ = await run_phase(
+                'provision', timeout, [git_slots, io_budget.hold(nbytes)], provision,
+                repo, entry['language'], aname, opts, problem_bank)
+            record.update(status='ok', branch=hw_branch)
+            return record
+
+        hw_branch, base, hdir_name, sequelp, is_vignette = \
+            await run_phase('plan_assignment', timeout, [git_slots], plan_assignment,
+                            repo, aname, opts, problem_bank)
+        await run_phase('make_hw_branch', timeout, [git_slots], make_hw_branch,
+                        repo, hw_branch, base)
+
+        if not sequelp:
+            hw_dir = os.path.join(repo.working_tree_dir, hdir_name)
+            nbytes = 0 if opts.no_install else \
+                problem_entry(aname, problem_bank)['bytes']
+            await run_phase('install_assignment', timeout, [io_budget.hold(nbytes)],
+                            install_assignment, entry['language'], hdir_name, hw_dir,
+                            problem_bank, opts)
+            if not opts.no_commit:
+                await run_phase('commit_assignment', timeout, [git_slots], commit_assignment,
+                                repo, hdir_name, hw_branch, opts.jobs)
+
+        if opts.all_parts and is_vignette:
+            _, num_parts = get_problem_info(aname, problem_bank)
+            await run_phase('create_remaining_parts', timeout, [git_slots],
+                            create_remaining_parts, repo, hw_branch, num_parts)
+        record.update(status='ok', branch=hw_branch)
+    except PhaseTimeoutError:
+        raise  # for run_group, which must wait out the abandoned phase
+    except HomeworkError as e:
+        record.update(status='failed', error=" ".join(str(m) for m in e.args))
+    except Exception as e:
+        record.update(status='failed', error="{}: {}".format(type(e).__name__, e))
+    return record
+
+
+async def run_fleet(groups, opts, on_done):
+    """Provision groups of manifest entries concurrently with asyncio.
+
+    Each group holds the entries for one repository, which are provisioned in
+    order. At most opts.workers repositories are in progress at once, at most
+    opts.max_git phases that run git are in flight, and installs are admitted
+    while the problem bank bytes they will transfer fit in opts.max_io_bytes
+    MiB. on_done is called with the list of records for each finished entry.
+
+    When a phase times out, the rest of its repository's entries fail too,
+    and the repository's slot, like the phase's git slot and I/O budget, is
+    held until the abandoned phase's thread finishes. So abandoned phases
+    count against every limit, and never leave a thread working on a
+    repository while another entry for it is provisioned.
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=opts.workers))
+    repo_slots = asyncio.Semaphore(opts.workers)
+    git_slots = asyncio.Semaphore(opts.max_git)
+    io_budget = ByteBudget(opts.max_io_bytes << 20)
+
+    async def run_group(entries):
+        async with repo_slots:
+            for i, entry in enumerate(entries):
+                try:
+                    record = await fleet_entry(entry, opts, git_slots, io_budget)
+                except PhaseTimeoutError as e:
+                    error = " ".join(str(m) for m in e.args)
+                    on_done([dict(entry, status='failed', error=error)] +
+                            [dict(later, status='failed',
+                                  error="Not attempted: an earlier entry timed out.")
+                             for later in entries[i + 1:]])
+                    await e.pending
+                    return
+                on_done([record])
+
+    await asyncio.gather(*[run_group(g) for g in groups])
+
+
+# Provisioning daemon
+
+SOCKET_ENV = 'NEW_HOMEWORK_SOCKET'
+
+# Options that the daemon refuses, as they write outside the repository
+UNSERVED_OPTIONS = ['--batch', '--serve', '--pack-bank', '--bank-remote',
+                    '--profile', '--trace']
+
+# Options that the daemon does not serve; the client runs these itself
+LOCAL_OPTIONS = UNSERVED_OPTIONS + ['-h', '--help']
+
+SOCKET_MODE = 0o600    # only the daemon's user may connect
+
+
+def client_socket(argv):
+    """Split the daemon socket out of argv.
+
+    Return (socket path, remaining argv). The path comes from --socket, or
+    else from $NEW_HOMEWORK_SOCKET, and is None if neither is given or argv
+    asks for something the daemon does not serve.
+    """
+    path = os.environ.get(SOCKET_ENV)
+    rest = []
+    args = iter(argv)
+    for arg in args:
+        if arg == '--socket':
+            path = next(args, None)
+        elif arg.startswith('--socket='):
+            path = arg[len('--socket='):]
+        else:
+            rest.append(arg)
+    if any(arg.split('=')[0] in LOCAL_OPTIONS for arg in rest):
+        path = None
+    return path, rest
+
+
+def request_daemon(path, argv, cwd):
+    """Ask the daemon at socket path to run the command line argv from cwd.
+
+    Print the command's captured output and return its exit status, or return
+    None without sending anything if there is no daemon listening at path.
+    """
+    import socket
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return None
+        try:
+            sock.sendall(json.dumps({'argv': argv, 'cwd': cwd}).encode() + b"\n")
+            with sock.makefile('rb') as f:
+                reply = json.loads(f.readline())
+        except (OSError, ValueError) as e:
+            report_error(HomeworkError("Lost the provisioning daemon at {}: {}".format(path, e)))
+            return 1
+    sys.stdout.write(reply['stdout'])
+    sys.stderr.write(reply['stderr'])
+    return reply['status']
+
+
+def init_serve_worker(indexes, verbosity):
+    """Warm a daemon worker: seed its problem bank indexes and import GitPython."""
+    init_batch_worker(indexes, verbosity)
+    import_git()
+
+
+def revalidate_problem_indexes():
+    """Forget in-memory problem bank indexes whose banks have changed since loading."""
+    for bank, index in list(_problem_indexes.items()):
+        if index['stamp'] != bank_stamp(bank):
+            del _problem_indexes[bank]
+
+
+def serve_request(argv, cwd, repo_dir, problem_bank):
+    """Run the command line argv as if from cwd, in a daemon worker.
+
+    The request acts on the repository repo_dir, as authorized by
+    authorize_request, and installs from the daemon's problem_bank (or, if
+    that is None, the bank beside the repository), whatever -p it gives.
+    Return a reply with the exit status and the captured standard output and
+    error of the run.
+    """
+    from contextlib import redirect_stdout, redirect_stderr
+
+    revalidate_problem_indexes()
+    out, err = io.StringIO(), io.StringIO()
+    with redirect_stdout(out), redirect_stderr(err):
+        try:
+            parser = build_parser()
+            args = parser.parse_args(argv)
+            unserved = [o for o in UNSERVED_OPTIONS if getattr(args, o[2:].replace('-', '_'))]
+            if unserved:
+                parser.error("{} cannot be sent to the daemon".format(", ".join(unserved)))
+            if args.worktree_dir:
+                args.worktree_dir = os.path.join(cwd, os.path.expanduser(args.worktree_dir))
+            args.problems = problem_bank
+            args.repo = repo_dir
+            status = run(args, parser, cwd)
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception as e:
+            report_error(HomeworkError("{}: {}".format(type(e).__name__, e)))
+            status = 1
+    return {'status': status, 'stdout': out.getvalue(), 'stderr': err.getvalue()}
+
+
+def request_repo(argv, cwd):
+    """Return the directory of the repository the command line argv acts on.
+
+    Requests are serialized on this key, so it need only agree for the same
+    repository; requests the daemon cannot parse are keyed by cwd.
+    """
+    try:
+        args = build_parser().parse_args(argv)
+    except SystemExit:
+        return cwd
+    if args.repo:
+        return os.path.realpath(os.path.join(cwd, os.path.expanduser(args.repo)))
+    if args.guess_repo:
+        repo = find_repo(None, True, cwd)
+        if repo is not None:
+            return os.path.realpath(repo.working_tree_dir)
+    return os.path.realpath(cwd)
+
+
+def peer_uid(sock):
+    """Return the uid of the process at the other end of Unix socket sock, or None."""
+    import socket
+
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+
+def authorize_request(argv, cwd, uid):
+    """Check that user uid may run argv from cwd.
+
+    Only the daemon's own user is served: the daemon acts with its own
+    privileges, and what it writes belongs to its user, so it does not act
+    for anyone else. Return the repository the request acts on. Calls die()
+    if the request is refused.
+    """
+    if uid is None:
+        die("Cannot tell who sent the request, so it is refused.")
+    if uid != os.getuid():
+        die("This daemon serves only its own user; run your own with --serve.")
+    return request_repo(argv, cwd)
+
+
+async def serve(opts):
+    """Serve provisioning requests on the Unix socket opts.serve until signalled.
+
+    Each request is a line of JSON with the client's argv and cwd, answered by
+    a line of JSON from serve_request. Requests run in a pool of opts.workers
+    warm processes; requests for the same repository run one at a time, in
+    the order they arrive. The socket is created with SOCKET_MODE, and each
+    request is checked by authorize_request against the connecting user.
+    Every request installs from the bank given by opts.problems.
+    """
+    import asyncio
+    import signal
+    from concurrent.futures import ProcessPoolExecutor
+    from contextlib import redirect_stderr
+
+    import socket
+
+    path = opts.serve
+    if os.path.exists(path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            if sock.connect_ex(path) == 0:
+                die("A daemon is already serving {}.".format(path))
+        os.unlink(path)  # left behind by a daemon that did not shut down
+
+    indexes = {}
+    bank = None
+    if opts.problems:
+        bank = check_problem_bank(None, opts.problems)
+        indexes[bank] = problem_index(bank)
+
+    loop = asyncio.get_running_loop()
+    locks = {}    # repository -> [lock, number of requests holding or awaiting it]
+
+    async def handle(reader, writer):
+        try:
+            line = await reader.readline()
+            if not line:
+                return  # a connection made only to see if we are listening
+            request = json.loads(line)
+            argv, cwd = request['argv'], request['cwd']
+            uid = peer_uid(writer.get_extra_info('socket'))
+            try:
+                key = await loop.run_in_executor(None, authorize_request,
+                                                 argv, cwd, uid)
+            except HomeworkError as e:
+                err = io.StringIO()
+                with redirect_stderr(err):
+                    report_error(e)
+                reply = {'status': 1, 'stdout': '', 'stderr': err.getvalue()}
+            else:
+                entry = locks.setdefault(key, [asyncio.Lock(), 0])
+                entry[1] += 1
+                try:
+                    async with entry[0]:
+                        reply = await loop.run_in_executor(pool, serve_request,
+                                                           argv, cwd, key, bank)
+                finally:
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del locks[key]
+            writer.write(json.dumps(reply).encode() + b"\n")
+            await writer.drain()
+        except Exception as e:
+            log("Dropped a request: {}: {}".format(type(e).__name__, e))
+        finally:
+            writer.close()
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    with ProcessPoolExecutor(max_workers=opts.workers,
+                             initializer=init_serve_worker,
+                             initargs=(indexes, verbose)) as pool:
+        umask = os.umask(0o777 & ~SOCKET_MODE)
+        try:
+            server = await asyncio.start_unix_server(handle, path=path)
+        finally:
+            os.umask(umask)
+        print("Serving on {} with {} workers.".format(path, opts.workers), file=sys.stderr)
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            os.unlink(path)
+
+
+# Main Script
+
+def build_parser():
+    """Return the command-line argument parser."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Install a new homework "
+                                     "assignment to the repository.",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog=__doc__[__doc__.index('\n'):])
+
+    parser.add_argument("-b", "--base",
+                        type=str,
+                        default='',
+                        help="Starting point at which to create the new assignment branch. "
+                        "Defaults to master, the tip of the master branch. Useful if you "
+                        "need to manually set up a vignette.")
+
+    parser.add_argument("-x", "--suffix",
+                        type=int,
+                        default=None,
+                        help="For vignettes, the number of the part to start, when "
+                        "skipping parts. It must exceed the largest part number "
+                        "already started.")
+
+    parser.add_argument("--all-parts",
+                        default=False,
+                        action='store_true',
+                        help="For vignettes, also create the branches for every "
+                        "later part at once, all starting from this part's commit.")
+
+    parser.add_argument("-g", "--guess-repo",
+                        default=False,
+                        action='store_true',
+                        help="If no repo is specified on the command line, "
+                        "attempt to find it nearby or in a few likely "
+                        "directories below the user's HOME.")
+
+    parser.add_argument("--no-commit",
+                        default=False,
+                        action='store_true',
+                        help="Skip initial commit on assignment branch.")
+
+    parser.add_argument("--no-install",
+                        default=False,
+                        action='store_true',
+                        help="Skip installation of assignment files.")
+
+    parser.add_argument("--install-mode",
+                        choices=INSTALL_MODES,
+                        default='copy',
+                        help="How to install problem bank files: 'copy' them, or "
+                        "'link' them from a shared local object store by reflink "
+                        "or hard link, which saves time and disk space for large "
+                        "datasets. Linked files are read-only; a hard-linked file "
+                        "made writable and edited in place changes in every "
+                        "repository it was installed into, so use 'link' only "
+                        "where they all belong to the same user.")
+
+    parser.add_argument("-j", "--jobs",
+                        type=int,
+                        default=DEFAULT_JOBS,
+                        help="Number of threads used to install problem bank "
+                        "files (default %(default)s).")
+
+    parser.add_argument("--plumbing",
+                        default=False,
+                        action='store_true',
+                        help="Write the assignment's files and initial commit "
+                        "directly into the repository's object database and create "
+                        "the branch without checking it out, leaving the working "
+                        "tree untouched. Much faster in large repositories.")
+
+    parser.add_argument("--checkout",
+                        default=False,
+                        action='store_true',
+                        help="With --plumbing, check out the new branch afterwards.")
+
+    parser.add_argument("--worktree",
+                        default=False,
+                        action='store_true',
+                        help="Set up the assignment branch in a new git worktree "
+                        "whose sparse checkout holds only the assignment directory "
+                        "and the top-level files. The repository's own working "
+                        "tree is left alone.")
+
+    parser.add_argument("--worktree-dir",
+                        default="",
+                        metavar="DIR",
+                        help="With --worktree, where to create the worktree. "
+                        "Defaults to a sibling of the repository named after it and "
+                        "the branch.")
+
+    parser.add_argument("-p", "--problems",
+                        type=str,
+                        default="",
+                        help="Path of problem-bank repository directory. "
+                        "If not supplied, use ../problem-bank from the homework repo.")
+
+    parser.add_argument("--bank-remote",
+                        default="",
+                        metavar="URL",
+                        help="Fetch the problem bank from the git remote URL rather "
+                        "than using a local checkout, downloading only the files of "
+                        "the assignment requested. The clone is cached across runs.")
+
+    parser.add_argument("-r", "--repo",
+                        type=str,
+                        default="",
+                        help="Path to assignments repository directory. "
+                        "If not supplied, use a guessed directory if -g option"
+                        "is supplied, or the current directory otherwise.")
+
+    parser.add_argument("-v", "--verbose",
+                        default=False,
+                        action='store_true',
+                        help="Provide a log of actions taken to standard error.")
+
+    parser.add_argument("--version",
+                        action='version',
+                        version='%(prog)s ' + __version__,
+                        help="Show version information and exit.")
+
+    parser.add_argument("-w", "--warn-if-exists",
+                        default=False,
+                        action='store_true',
+                        help="Warn without failure if homework branch already exists.")
+
+    parser.add_argument("--batch",
+                        metavar="MANIFEST",
+                        default="",
+                        help="Provision every assignment listed in MANIFEST, a CSV "
+                        "file with columns repo, language, and assignment, or a "
+                        "JSONL file of objects with those keys. The language and "
+                        "assignment arguments are then omitted.")
+
+    parser.add_argument("--journal",
+                        default="",
+                        help="Journal of completed batch entries, used to resume an "
+                        "interrupted batch. Defaults to MANIFEST.journal.")
+
+    parser.add_argument("--workers",
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help="Number of repositories to provision at once in "
+                        "batch and daemon mode (default %(default)s).")
+
+    parser.add_argument("--fleet",
+                        default=False,
+                        action='store_true',
+                        help="In batch mode, provision repositories concurrently "
+                        "with asyncio in this process, limiting git processes and "
+                        "file I/O in flight and timing out hung phases.")
+
+    parser.add_argument("--max-git",
+                        type=int,
+                        default=8,
+                        help="With --fleet, the most phases running git at once "
+                        "(default %(default)s).")
+
+    parser.add_argument("--max-io-bytes",
+                        type=int,
+                        default=1024,
+                        metavar="MIB",
+                        help="With --fleet, the most MiB of problem bank files being "
+                        "installed at once (default %(default)s).")
+
+    parser.add_argument("--phase-timeout",
+                        type=float,
+                        default=600,
+                        metavar="SECONDS",
+                        help="With --fleet, fail a repository if any one phase takes "
+                        "longer than this (default %(default)s).")
+
+    parser.add_argument("--pack-bank",
+                        default=False,
+                        action='store_true',
+                        help="Pack the problem bank (see -p) into a single indexed "
+                        "file, " + PACK_NAME + ", from which assignments are then "
+                        "installed. Run again after updating the bank.")
+
+    parser.add_argument("--profile",
+                        default="",
+                        metavar="FILE",
+                        help="Append the wall time, files, bytes, and git processes "
+                        "of each phase of provisioning to FILE as JSON lines. In "
+                        "batch mode, also print percentiles of each phase.")
+
+    parser.add_argument("--trace",
+                        default="",
+                        metavar="FILE",
+                        help="Write the phases of provisioning to FILE as Chrome "
+                        "trace events, for chrome://tracing or Perfetto.")
+
+    parser.add_argument("--serve",
+                        default="",
+                        metavar="SOCKET",
+                        help="Run as a daemon, provisioning the assignments requested "
+                        "over the Unix socket SOCKET with --socket, from the bank "
+                        "given by -p, for this user only. Keeps the problem bank "
+                        "index and --workers warm worker processes in memory.")
+
+    parser.add_argument("--socket",
+                        default="",
+                        metavar="SOCKET",
+                        help="Send this command to the daemon serving SOCKET (see "
+                        "--serve) rather than running it here; also taken from $"
+                        + SOCKET_ENV + ". Runs here if no daemon is listening.")
+
+    parser.add_argument("language",
+                        nargs="?",
+                        help="Language you will use for the assignment. "
+                        "The script will install a simple template for that language, "
+                        "if it is supported and --no-install is not passed. Valid "
+                        "options are 'r', 'python', or 'none' to install no template.")
+
+    parser.add_argument("assignment",
+                        nargs="?",
+                        type=str,
+                        help="Name of the homework assignment to create. Use the "
+                        "official name from the homework repository, like "
+                        "test-this or cow-proximity.")
+
+    return parser
+
+
+def run(args, parser, cwd):
+    """Carry out the parsed command line args as if run from cwd.
+
+    Report errors and return the exit status. With --profile or --trace, the
+    phases of the run are profiled and written out at the end.
+    """
+    global verbose
+
+    verbose = args.verbose
+    if args.profile or args.trace:
+        start_profiling()
+    try:
+        return run_command(args, parser, cwd)
+    finally:
+        if _profile is not None:
+            write_profile(stop_profiling(), args.profile, args.trace)
+
+
+def run_command(args, parser, cwd):
+    """Carry out the parsed command line args for run."""
+    try:
+        if args.bank_remote:
+            names = [e['assignment'] for e in read_manifest(args.batch)] \
+                if args.batch else [args.assignment] if args.assignment else []
+            args.problems = remote_problem_bank(args.bank_remote, names)
+
+        if args.batch:
+            return 1 if run_batch(args) else 0
+
+        if args.pack_bank:
+            problem_bank = check_problem_bank(args.repo or cwd, args.problems)
+            nfiles, nbytes = pack_bank(problem_bank)
+            print("Packed {} files ({:.1f} MiB) into {}."
+                  .format(nfiles, nbytes / 2**20, os.path.join(problem_bank, PACK_NAME)),
+                  file=sys.stderr)
+            return 0
+
+        if not (args.language and args.assignment):
+            parser.error("the language and assignment arguments are required")
+
+        if args.repo or not args.guess_repo:
+            quick_check(args.repo or cwd, args.problems, args.assignment)
+        repo = open_repo(args.repo, args.guess_repo, cwd)
+
+        # Sanity-check the problem bank and the assignment they requested.
+        problem_bank = check_problem_bank(repo.working_tree_dir, args.problems)
+        hw_branch, hw_dir, is_vignette = \
+            provision(repo, args.language, args.assignment, args, problem_bank)
+    except HomeworkError as e:
+        report_error(e)
+        return 1
+
+    hdir_name = os.path.basename(hw_dir)
+    if args.plumbing and not (args.checkout or args.worktree):
+        print("Created branch {} for assignment {}.\n"
+              "Type 'git checkout {}' at the shell prompt when you are ready to work."
+              .format(hw_branch, hdir_name, hw_branch), file=sys.stderr)
+    elif is_vignette:
+        print("Switched to branch '{}' for vignette '{}'.\n"
+              "Type 'cd {}' at the shell prompt, and you are ready to work!"
+              .format(hw_branch, hdir_name, os.path.relpath(hw_dir, cwd)),
+              file=sys.stderr)
+    else:
+        print("Switched to branch {} for assignment {}.\n"
+              "Type 'cd {}' at the shell prompt, and you are ready to work!"
+              .format(hw_branch, hdir_name, os.path.relpath(hw_dir, cwd)),
+              file=sys.stderr)
+    return 0
+
+
+def main(argv=None):
+    global verbose
+
+    if argv is None:
+        argv = sys.argv[1:]
+    if '--version' in argv:
+        # Answer without building the parser, as its version action would
+        print("{} {}".format(os.path.basename(sys.argv[0]), __version__))
+        return
+
+    cwd = os.getcwd()
+    path, rest = client_socket(argv)
+    if path:
+        status = request_daemon(path, rest, cwd)
+        if status is not None:
+            sys.exit(status)
+        # No daemon is listening, so do the work here
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        import asyncio
+
+        verbose = args.verbose
+        try:
+            asyncio.run(serve(args))
+        except HomeworkError as e:
+            report_error(e)
+            sys.exit(1)
+        return
+
+    sys.exit(run(args, parser, cwd))
+
 
-if is_vignette:
-    print("Switched to branch '{}' for vignette '{}'.\n"
-          "Type 'cd {}' at the shell prompt, and you are ready to work!"
-          .format(hw_branch, hdir_name, os.path.relpath(hw_dir, cwd)),
-          file=sys.stderr)
-else:
-    print("Switched to branch {} for assignment {}.\n"
-          "Type 'cd {}' at the shell prompt, and you are ready to work!"
-          .format(hw_branch, hdir_name, os.path.relpath(hw_dir, cwd)),
-          file=sys.stderr)
+if __name__ == "__main__":
+    main()
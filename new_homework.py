@@ -0,0 +1,17 @@
+# -*- mode: python; coding: utf-8 -*-
+
+"""new_homework -- Import new-homework.py as a module
+
+The script's name is not a valid module name, so this module loads it in its
+own place: `import new_homework` gives the functions of new-homework.py.
+"""
+
+import os.path
+import sys
+import importlib.util
+
+_spec = importlib.util.spec_from_file_location(
+    __name__, os.path.join(os.path.dirname(os.path.abspath(__file__)), "new-homework.py"))
+_module = importlib.util.module_from_spec(_spec)
+sys.modules[__name__] = _module
+_spec.loader.exec_module(_module)
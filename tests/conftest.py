@@ -0,0 +1,92 @@
+# -*- mode: python; coding: utf-8 -*-
+
+"""Fixtures for the tests: a small problem bank and an assignments repository
+
+Each test gets its own cache directory, and the in-memory caches of
+new-homework.py are emptied around it, so that tests do not see each other's
+indexes, packs, or stored objects.
+"""
+
+import os
+import sys
+import shutil
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "new-homework.py")
+
+sys.path.insert(0, ROOT)
+
+import new_homework as nh  # noqa: E402
+
+
+def write(path, text):
+    """Write text to path, creating its directory."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def git(repo, *args):
+    """Run git in repo and return its stripped output."""
+    return subprocess.run(['git', '-C', str(repo)] + list(args), check=True,
+                          stdout=subprocess.PIPE, text=True).stdout.strip()
+
+
+def run_script(cwd, *args):
+    """Run new-homework.py from cwd; return the completed process."""
+    return subprocess.run([sys.executable, SCRIPT] + [str(a) for a in args], cwd=str(cwd),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+
+def commit_all(repo, message):
+    git(repo, 'add', '-A')
+    git(repo, '-c', 'user.name=test', '-c', 'user.email=test@example.com',
+        'commit', '-q', '-m', message)
+
+
+def forget_caches():
+    for cache in (nh._ref_indexes, nh._problem_indexes, nh._bank_packs,
+                  nh._object_hashes, nh._template_sets):
+        cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    """Give the test its own cache directory, and nothing cached in memory."""
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / "cache"))
+    forget_caches()
+    yield tmp_path / "cache"
+    forget_caches()
+
+
+@pytest.fixture
+def bank(tmp_path):
+    """A problem bank with hw-one (with data and a template), a three-part
+    vignette vig, and plain (a PDF alone)."""
+    bank = tmp_path / "problem-bank"
+    write(str(bank / "points.csv"), "name,points\nhw-one,10\nvig,5\nvig,5\nvig,5\nplain,3\n")
+    for name in ['hw-one', 'vig', 'plain']:
+        write(str(bank / "All" / (name + ".pdf")), "pdf " + name + "\n")
+    write(str(bank / "Data" / "hw-one" / "d.csv"), "a,b\n1,2\n")
+    write(str(bank / "Data" / "hw-one" / "sub" / "x.txt"), "deep\n")
+    write(str(bank / "Resources" / "hw-one" / "r.txt"), "resource\n")
+    write(str(bank / "Skel" / "hw-one" / "python" / "ASSIGN.py"), "def ASSIGN():\n    pass\n")
+    write(str(bank / ".skel" / "python" / "ASSIGN.py"), "# ASSIGN\n")
+    write(str(bank / ".skel" / "r" / "ASSIGN.R"), "ASSIGN <- function() {}\n")
+    return str(bank)
+
+
+@pytest.fixture
+def repo(tmp_path):
+    """An assignments repository with one commit on master, tagged clean-start."""
+    repo = tmp_path / "assignments-test"
+    subprocess.run(['git', 'init', '-q', '-b', 'master', str(repo)], check=True)
+    git(repo, 'config', 'user.name', 'test')
+    git(repo, 'config', 'user.email', 'test@example.com')
+    shutil.copy(os.path.join(ROOT, "check.R"), str(repo))
+    commit_all(repo, "init")
+    git(repo, 'tag', 'clean-start')
+    return str(repo)
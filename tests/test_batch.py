@@ -0,0 +1,84 @@
+# -*- mode: python; coding: utf-8 -*-
+
+import os
+import time
+import asyncio
+import threading
+
+import pytest
+
+from conftest import nh, git, run_script, write
+
+
+def write_manifest(path, rows):
+    write(path, "repo,language,assignment\n" + "".join(
+        "{},{},{}\n".format(*row) for row in rows))
+
+
+def test_manifest_counts_repeated_entries(tmp_path):
+    manifest = str(tmp_path / "m.csv")
+    write_manifest(manifest, [('a', 'python', 'vig'), ('b', 'python', 'vig'),
+                              ('a', 'python', 'vig'), ('a', 'r', 'vig')])
+    entries = nh.read_manifest(manifest)
+    assert [e['occurrence'] for e in entries] == [1, 1, 2, 1]
+    assert entries[0]['repo'] == str(tmp_path / "a")
+    assert len({nh.journal_key(e) for e in entries}) == 4
+
+
+@pytest.mark.parametrize("fleet", [False, True])
+def test_resumed_after_manifest_edit(tmp_path, repo, bank, fleet):
+    manifest = str(tmp_path / "m.csv")
+    flags = ['--fleet'] if fleet else []
+    write_manifest(manifest, [(repo, 'python', 'vig')] * 2)
+    proc = run_script(tmp_path, '-p', bank, '--batch', manifest, *flags)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    assert "2 provisioned, 0 failed, 0 skipped" in proc.stdout
+
+    # Lines added before and among the done entries leave them done
+    write_manifest(manifest, [(repo, 'python', 'plain')] + [(repo, 'python', 'vig')] * 3)
+    proc = run_script(tmp_path, '-p', bank, '--batch', manifest, *flags)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    assert "2 provisioned, 0 failed, 2 skipped" in proc.stdout
+    assert git(repo, 'branch', '--format=%(refname:short)').split() == [
+        'master', 'plain', 'vig-1', 'vig-2', 'vig-3']
+
+
+def test_worker_crash_keeps_journaled_entries(tmp_path, repo, bank, monkeypatch, capsys):
+    provision_entry = nh.provision_entry
+
+    def crash_on_plain(entry, opts):
+        if entry['assignment'] == 'plain':
+            os._exit(1)
+        return provision_entry(entry, opts)
+
+    # Forked workers inherit the patch
+    monkeypatch.setattr(nh, 'provision_entry', crash_on_plain)
+    manifest = str(tmp_path / "m.csv")
+    write_manifest(manifest, [(repo, 'python', 'hw-one'), (repo, 'python', 'plain'),
+                              (repo, 'python', 'vig')])
+    opts = nh.build_parser().parse_args(['-p', bank, '--batch', manifest])
+    assert nh.run_batch(opts) == 2
+    out = capsys.readouterr().out
+    assert "ok      {} hw-one -> hw-one".format(repo) in out
+    assert "FAILED  {} plain: Worker process failed".format(repo) in out
+
+    done = nh.read_journal(manifest + ".journal")
+    assert done == {(repo, 'python', 'hw-one', 1)}
+
+
+def test_timed_out_phase_keeps_its_holds():
+    finished = threading.Event()
+
+    def slow():
+        time.sleep(0.3)
+        finished.set()
+
+    async def main():
+        slots = asyncio.Semaphore(1)
+        with pytest.raises(nh.PhaseTimeoutError) as excinfo:
+            await nh.run_phase('slow', 0.05, [slots], slow)
+        assert slots.locked() and not finished.is_set()
+        await excinfo.value.pending
+        assert not slots.locked() and finished.is_set()
+
+    asyncio.run(main())
@@ -0,0 +1,57 @@
+# -*- mode: python; coding: utf-8 -*-
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+import pytest
+
+from conftest import nh, git, run_script, SCRIPT
+
+
+def test_other_users_refused(repo):
+    argv = ['python', 'hw-one']
+    with pytest.raises(nh.HomeworkError):
+        nh.authorize_request(argv, repo, os.getuid() + 1)
+    with pytest.raises(nh.HomeworkError):
+        nh.authorize_request(argv, repo, None)
+    assert nh.authorize_request(argv, repo, os.getuid()) == os.path.realpath(repo)
+
+
+def test_request_uses_daemons_bank(repo, bank):
+    reply = nh.serve_request(['-p', '/nonexistent', 'python', 'hw-one'], repo, repo, bank)
+    assert reply['status'] == 0, reply['stderr']
+    assert git(repo, 'rev-parse', '--abbrev-ref', 'HEAD') == 'hw-one'
+    assert os.path.exists(os.path.join(repo, 'hw-one', 'Data', 'd.csv'))
+
+
+def test_unserved_options_refused(repo, bank):
+    reply = nh.serve_request(['--pack-bank', 'python', 'hw-one'], repo, repo, bank)
+    assert reply['status'] == 2
+    assert "--pack-bank cannot be sent to the daemon" in reply['stderr']
+
+
+def test_served_over_socket(repo, bank):
+    # Unix socket paths are short, so not under tmp_path
+    sockdir = tempfile.mkdtemp(prefix="nh-")
+    path = os.path.join(sockdir, "sock")
+    daemon = subprocess.Popen([sys.executable, SCRIPT, '--serve', path, '-p', bank,
+                               '--workers', '1'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.05)
+        assert os.stat(path).st_mode & 0o777 == nh.SOCKET_MODE
+
+        proc = run_script(repo, '--socket', path, '-p', '/nonexistent', 'python', 'plain')
+        assert proc.returncode == 0, proc.stderr
+        assert git(repo, 'rev-parse', '--abbrev-ref', 'HEAD') == 'plain'
+    finally:
+        daemon.terminate()
+        daemon.wait(10)
+        shutil.rmtree(sockdir, ignore_errors=True)
@@ -0,0 +1,35 @@
+# -*- mode: python; coding: utf-8 -*-
+
+import os
+import importlib.util
+
+import pytest
+
+from conftest import ROOT
+
+_spec = importlib.util.spec_from_file_location(
+    "grade_homework", os.path.join(ROOT, "grade-homework.py"))
+gh = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(gh)
+
+
+def test_workers_has_no_short_option():
+    parser = gh.build_parser()
+    assert parser.parse_args(['--workers', '3']).workers == 3
+    with pytest.raises(SystemExit):
+        parser.parse_args(['-j', '3'])
+
+
+def test_fingerprint_follows_versions():
+    versions = ["R 4.3.1", "testthat 3.2.0", "lintr 3.1.0"]
+    upgraded = ["R 4.3.1", "testthat 3.2.1", "lintr 3.1.0"]
+    assert gh.checker_fingerprint("Rscript", versions) == \
+        gh.checker_fingerprint("/usr/bin/Rscript", versions)
+    assert gh.checker_fingerprint("Rscript", versions) != \
+        gh.checker_fingerprint("Rscript", upgraded)
+
+
+def test_counts_parsed_from_markers():
+    assert gh.parse_counts("noise\n@@lints 2\n@@tests 5 1 0 0\n") == {
+        'lints': 2, 'tests': 5, 'failures': 1, 'skipped': 0, 'errors': 0}
+    assert gh.parse_counts("R crashed\n") is None
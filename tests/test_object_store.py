@@ -0,0 +1,86 @@
+# -*- mode: python; coding: utf-8 -*-
+
+import os
+import json
+import threading
+
+from conftest import nh, write
+
+
+def run_threads(target, n=8):
+    errors = []
+
+    def run(i):
+        try:
+            target(i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+def test_write_json_atomically_from_threads(tmp_path):
+    path = str(tmp_path / "data.json")
+
+    def writes(i):
+        for k in range(50):
+            nh.write_json_atomically(path, {'thread': i, 'k': k})
+
+    assert run_threads(writes) == []
+    with open(path) as f:
+        assert json.load(f)['k'] == 49
+    assert os.listdir(str(tmp_path)) == ["data.json"]
+
+
+def test_hash_cache_saved_from_threads(tmp_path):
+    sources = []
+    for i in range(8):
+        sources.append(str(tmp_path / "src" / "f{}.txt".format(i)))
+        write(sources[-1], "file {}\n".format(i) * 100)
+
+    def hashes(i):
+        for k in range(20):
+            nh.source_sha256(sources[(i + k) % len(sources)])
+            nh.save_object_hashes()
+
+    assert run_threads(hashes) == []
+    with open(os.path.join(nh.object_store(), "hashes.json")) as f:
+        saved = json.load(f)
+    assert sorted(saved) == sorted(sources)
+    assert saved[sources[0]][2] == nh.file_sha256(sources[0])
+
+
+def test_changed_object_replaced(tmp_path):
+    src = str(tmp_path / "src.txt")
+    write(src, "hello\n")
+    obj = nh.store_object(src)
+    linked = str(tmp_path / "linked.txt")
+    os.link(obj, linked)
+
+    # A user makes their hard-linked copy writable and edits it in place
+    os.chmod(linked, 0o644)
+    with open(linked, "a") as f:
+        f.write("edited\n")
+
+    again = nh.store_object(src)
+    assert again == obj
+    with open(again) as f:
+        assert f.read() == "hello\n"
+    assert not os.path.samefile(again, linked)
+    assert os.stat(again).st_mode & 0o777 == 0o444
+
+
+def test_touched_object_kept(tmp_path):
+    src = str(tmp_path / "src.txt")
+    write(src, "hello\n")
+    obj = nh.store_object(src)
+    inode = os.stat(obj).st_ino
+    os.utime(obj)
+
+    assert nh.store_object(src) == obj
+    assert os.stat(obj).st_ino == inode
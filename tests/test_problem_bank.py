@@ -0,0 +1,61 @@
+# -*- mode: python; coding: utf-8 -*-
+
+import os
+import time
+
+from conftest import nh, git, commit_all, write
+
+
+def test_index_lists_assignments(bank):
+    index = nh.problem_index(bank)
+    assert index['problems']['vig']['parts'] == 3
+    hw = index['problems']['hw-one']
+    assert hw['dirs'] == ['Data', 'Resources']
+    assert hw['languages'] == ['python']
+    files = ['All/hw-one.pdf', 'Data/hw-one/d.csv', 'Data/hw-one/sub/x.txt',
+             'Resources/hw-one/r.txt']
+    assert hw['bytes'] == sum(os.path.getsize(os.path.join(bank, f)) for f in files)
+    assert 'digest' not in hw
+
+
+def test_entry_rescanned_after_template_added(bank):
+    nh.problem_index(bank)
+    time.sleep(0.01)
+    write(os.path.join(bank, "Skel", "hw-one", "r", "ASSIGN.R"), "ASSIGN <- 1\n")
+    assert nh.problem_entry('hw-one', bank)['languages'] == ['python', 'r']
+
+    # and the rescan is saved, for the next process
+    nh._problem_indexes.clear()
+    assert nh.problem_index(bank)['problems']['hw-one']['languages'] == ['python', 'r']
+
+
+def test_pack_used_until_bank_head_moves(bank):
+    git(bank, 'init', '-q')
+    commit_all(bank, "bank")
+    nh.pack_bank(bank)
+
+    assert git(bank, 'status', '--porcelain') == ""
+    pack = nh.bank_pack(bank)
+    assert pack is not None
+    files = dict((rel, src) for src, rel in nh.problem_files('hw-one', bank))
+    assert isinstance(files[os.path.join('Data', 'sub', 'x.txt')], nh.PackMember)
+
+    write(os.path.join(bank, "Data", "hw-one", "d.csv"), "changed\n")
+    commit_all(bank, "change data")
+    assert nh.bank_pack(bank) is None
+    files = dict((rel, src) for src, rel in nh.problem_files('hw-one', bank))
+    with open(files[os.path.join('Data', 'd.csv')]) as f:
+        assert f.read() == "changed\n"
+
+    nh.pack_bank(bank)
+    assert nh.bank_pack(bank) is not None
+    assert git(bank, 'status', '--porcelain') == ""
+
+
+def test_pack_ignored_once_assignments_change(bank):
+    nh.pack_bank(bank)
+    assert nh.bank_pack(bank) is not None
+    time.sleep(0.01)
+    with open(os.path.join(bank, "points.csv"), "a") as f:
+        f.write("new,1\n")
+    assert nh.bank_pack(bank) is None
@@ -0,0 +1,53 @@
+# -*- mode: python; coding: utf-8 -*-
+
+import os
+
+from conftest import nh, git, run_script
+
+
+def test_plumbing_from_annotated_tag(repo, bank):
+    git(repo, 'tag', '-a', '-m', 'release', 'v1', 'master')
+    proc = run_script(repo, '--plumbing', '-b', 'v1', '-p', bank, 'python', 'hw-one')
+    assert proc.returncode == 0, proc.stderr
+
+    assert git(repo, 'rev-parse', 'hw-one^') == git(repo, 'rev-parse', 'master')
+    assert git(repo, 'ls-tree', '-r', '--name-only', 'hw-one', 'hw-one').splitlines() == [
+        'hw-one/.gitkeep', 'hw-one/Data/d.csv', 'hw-one/Data/sub/x.txt', 'hw-one/Resources/r.txt',
+        'hw-one/hw-one.pdf', 'hw-one/hw_one.py']
+    # Nothing was checked out
+    assert git(repo, 'rev-parse', '--abbrev-ref', 'HEAD') == 'master'
+    assert not os.path.exists(os.path.join(repo, 'hw-one'))
+
+
+def test_plumbing_sequel_from_annotated_tag(repo, bank):
+    git(repo, 'tag', '-a', '-m', 'release', 'v1', 'master')
+    proc = run_script(repo, '--plumbing', '-b', 'v1', '-p', bank, 'python', 'vig')
+    assert proc.returncode == 0, proc.stderr
+    proc = run_script(repo, '--plumbing', '-p', bank, 'python', 'vig')
+    assert proc.returncode == 0, proc.stderr
+
+    # The second part starts where the first does
+    assert git(repo, 'rev-parse', 'vig-1^') == git(repo, 'rev-parse', 'master')
+    assert git(repo, 'rev-parse', 'vig-2') == git(repo, 'rev-parse', 'vig-1')
+
+
+def test_plumbing_base_not_a_commit(repo, bank):
+    git(repo, 'tag', '-a', '-m', 'a tree', 'tree-tag', 'master^{tree}')
+    proc = run_script(repo, '--plumbing', '-b', 'tree-tag', '-p', bank, 'python', 'hw-one')
+    assert proc.returncode == 1
+    assert "tree-tag is not a commit" in proc.stderr
+
+
+def test_git_wrapped_only_while_profiling(repo, bank):
+    git_module = nh.import_git()
+    execute = git_module.cmd.Git.execute
+    assert not hasattr(execute, 'uncounted')
+
+    nh.start_profiling()
+    try:
+        with git_module.Repo(repo) as r:
+            nh.provision(r, 'python', 'plain', nh.provision_options(), bank)
+    finally:
+        records = nh.stop_profiling()
+    assert 'provision' in [record['phase'] for record in records]
+    assert git_module.cmd.Git.execute is execute